@@ -1,4 +1,5 @@
 import os
+import json
 import yaml
 from shutil import rmtree
 import docker
@@ -16,6 +17,16 @@ PLACEHOLDER_VALUES = {
     "{{ENV}}": [],
 }
 
+# Server settings that can be given as top-level keys in the config file, mapped to the
+# environment variables read by the server
+SERVER_CONFIG_ENV = {
+    "workers": "MDAI_WORKERS",
+    "decode_dicom": "MDAI_DECODE_DICOM",
+    "decode_size": "MDAI_DECODE_SIZE",
+    "lazy_datasets": "MDAI_LAZY_DATASETS",
+    "worker_command": "MDAI_WORKER_COMMAND",
+}
+
 PYTHON_VERSION_DICT = {"py37": "3.7", "py38": "3.8", "py39": "3.9", "py310": "3.10"}
 
 PARENT_IMAGE_DICT = {
@@ -117,6 +128,19 @@ def add_env_variables(placeholder_values, env_variables):
         placeholder_values[ENV].append(env_string)
 
 
+def add_server_variables(placeholder_values, config):
+    ENV = "{{ENV}}"
+    for key, env_key in SERVER_CONFIG_ENV.items():
+        if key in config:
+            value = config[key]
+            if isinstance(value, list):
+                value = ",".join(str(item) for item in value)
+            elif isinstance(value, str) and any(c.isspace() for c in value):
+                # Values with spaces, such as commands, need quoting in the Dockerfile
+                value = json.dumps(value)
+            placeholder_values[ENV].append(f"ENV {env_key}={value}")
+
+
 def copy_files(target_folder, docker_env):
     dest_dockerfile = process_dockerfile(docker_env, PLACEHOLDER_VALUES)
 
@@ -214,6 +238,7 @@ def create_docker_image(args):
         PLACEHOLDER_VALUES, config, PARENT_IMAGE_DICT, mdai_folder
     )
     add_env_variables(PLACEHOLDER_VALUES, config.get("env"))
+    add_server_variables(PLACEHOLDER_VALUES, config)
     relative_mdai_folder = os.path.relpath(mdai_folder, target_folder)
     os.chdir(os.path.join(BASE_DIRECTORY, "mdai"))
     copies = copy_files(target_folder, dockerfile_path)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import timeit
+from argparse import ArgumentParser
+
+BASE_DIRECTORY = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, os.path.join(BASE_DIRECTORY, "mdai"))
+
+from validation import OutputValidator  # noqa: E402
+
+UID = "1.2.276.0.7230010.3.1.4.940180736.574.1534894495.485466"
+
+
+def make_outputs(count, mask_size=0):
+    """
+    Synthetic per-frame outputs, in the proportions a video model would return them. With a
+    `mask_size`, frames without a box or polygon get a mask of that size.
+    """
+    outputs = []
+    for i in range(count):
+        output = {
+            "type": "ANNOTATION",
+            "study_uid": UID,
+            "series_uid": UID,
+            "instance_uid": UID,
+            "frame_number": i,
+            "class_index": i % 4,
+            "probability": 0.5,
+            "explanations": [],
+            "note": None,
+        }
+        if i % 3 == 0:
+            output["data"] = {"x": i, "y": i, "width": 20, "height": 30}
+        elif i % 3 == 1:
+            output["data"] = {"vertices": [[1, 2], [3, 4], [5, 6]]}
+        elif mask_size:
+            output["data"] = {"mask": [[i % 2] * mask_size for _ in range(mask_size)]}
+        else:
+            output["data"] = None
+        outputs.append(output)
+    return outputs
+
+
+def main():
+    parser = ArgumentParser(description="Measure the per-output cost of OutputValidator.validate")
+    parser.add_argument("--outputs", type=int, default=10000, help="outputs per validate call")
+    parser.add_argument("--repeat", type=int, default=20, help="number of validate calls")
+    parser.add_argument("--mask-size", type=int, default=0, help="width and height of masks")
+    parser.add_argument("--deep", action="store_true", help="check masks and vertices in full")
+    args = parser.parse_args()
+
+    validator = OutputValidator(deep=args.deep)
+    outputs = make_outputs(args.outputs, args.mask_size)
+    validator.validate(outputs)
+
+    seconds = min(timeit.repeat(lambda: validator.validate(outputs), number=1, repeat=args.repeat))
+    print(
+        "{} outputs: {:.2f} ms per call, {:.3f} us per output".format(
+            args.outputs, seconds * 1e3, seconds * 1e6 / args.outputs
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
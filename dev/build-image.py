@@ -120,6 +120,7 @@ if __name__ == "__main__":
             placeholder_values, config, helper.PARENT_IMAGE_DICT, mdai_folder
         )
         helper.add_env_variables(placeholder_values, config.get("env"))
+        helper.add_server_variables(placeholder_values, config)
         relative_mdai_folder = os.path.relpath(mdai_folder, target_folder)
         os.chdir(os.path.join(BASE_DIRECTORY, "mdai"))
         copies = copy_files(target_folder, dockerfile_path, placeholder_values)
@@ -1,7 +1,6 @@
 import cv2
 import numpy as np
-import tempfile
-import os
+from frames import video_file
 
 
 class MDAIModel:
@@ -35,35 +34,31 @@ class MDAIModel:
             if video_content is None:
                 continue
 
-            with tempfile.NamedTemporaryFile(suffix=".mp4", delete=False) as temp_video:
-                temp_video.write(video_content)
-                temp_video_path = temp_video.name
+            # Expose the content to OpenCV as an in-memory file instead of writing it to disk
+            with video_file(video_content) as video_path:
+                cap = cv2.VideoCapture(video_path)
 
-            cap = cv2.VideoCapture(temp_video_path)
+                if not cap.isOpened():
+                    print("Error: Could not open video file")
+                    continue
 
-            if not cap.isOpened():
-                print(f"Error: Could not open video file {temp_video_path}")
-                os.unlink(temp_video_path)
-                continue
-
-            frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-            frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+                frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+                frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+                frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
 
-            for frame_number in range(frame_count):
-                ret, frame = cap.read()
-                if not ret:
-                    break
+                for frame_number in range(frame_count):
+                    ret, frame = cap.read()
+                    if not ret:
+                        break
 
-                model_output = self._create_model_output(
-                    dicom_tags, frame_number, frame_count, frame_width, frame_height
-                )
-                outputs.append(model_output)
+                    model_output = self._create_model_output(
+                        dicom_tags, frame_number, frame_count, frame_width, frame_height
+                    )
+                    outputs.append(model_output)
 
-                print(f"Processing frame {frame_number}")
+                    print(f"Processing frame {frame_number}")
 
-            cap.release()
-            os.unlink(temp_video_path)
+                cap.release()
 
         return outputs
 
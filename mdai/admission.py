@@ -0,0 +1,72 @@
+import asyncio
+import math
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request body read past its declared size takes the queue over its limit."""
+
+
+class AdmissionController:
+    """
+    Bounds the number of admitted inference requests and the total size of their payloads.
+
+    A request is counted from the moment it is admitted until its response has been produced. A
+    limit of 0 disables the corresponding check. A request is always admitted when nothing else is
+    queued, so a single payload larger than `max_bytes` can still be served.
+    """
+
+    def __init__(self, max_requests=0, max_bytes=0, high_water=0):
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.high_water = high_water
+        self.requests = 0
+        self.bytes = 0
+
+    def admit(self, size):
+        if self.requests > 0:
+            if self.max_requests and self.requests >= self.max_requests:
+                return False
+            if self.max_bytes and self.bytes + size > self.max_bytes:
+                return False
+        self.requests += 1
+        self.bytes += size
+        return True
+
+    def charge(self, size):
+        """
+        Charge `size` more bytes to an admitted request, for a body read beyond its declared size,
+        such as a chunked upload. Raises `AdmissionRejected` if that takes the total over
+        `max_bytes` while other requests are admitted. The bytes stay charged until released.
+        """
+        self.bytes += size
+        if self.max_bytes and self.requests > 1 and self.bytes > self.max_bytes:
+            raise AdmissionRejected("Request body exceeds the queued bytes limit")
+
+    def release(self, size):
+        self.requests -= 1
+        self.bytes -= size
+
+    def busy(self):
+        """Whether the queue is at or above its high-water mark."""
+        return bool(self.high_water) and self.requests >= self.high_water
+
+
+def get_deadline(headers, header="x-request-timeout"):
+    """
+    Convert a relative request timeout header, in seconds, into an event loop deadline.
+    Returns None if the header is not set.
+    """
+    value = headers.get(header)
+    if not value:
+        return None
+    timeout = float(value)
+    if not math.isfinite(timeout) or timeout <= 0:
+        raise ValueError("Request timeout must be positive and finite, got {}".format(value))
+    return asyncio.get_event_loop().time() + timeout
+
+
+def time_remaining(deadline):
+    """Seconds left until `deadline`, or None if there is no deadline."""
+    if deadline is None:
+        return None
+    return max(deadline - asyncio.get_event_loop().time(), 0)
@@ -0,0 +1,91 @@
+import asyncio
+
+
+class BatchScheduler:
+    """
+    Collects concurrent inference requests into micro-batches.
+
+    Requests submitted within `max_wait_ms` of the first queued request are grouped, up to
+    `max_batch_size`, and handed to `run_batch(model, batch)` as a single list along with a model
+    checked out from the `replicas` pool, so batches run concurrently when the pool has several
+    replicas. `run_batch` must return one result per input, in order; each result is delivered
+    back to the caller that submitted it, and a result that is an exception is raised to that
+    caller only. `run_batch` is called on `executor`, or the event loop's default executor if
+    None.
+    """
+
+    def __init__(self, run_batch, replicas, max_batch_size=8, max_wait_ms=10, executor=None):
+        self.run_batch = run_batch
+        self.replicas = replicas
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue()
+        self.batch_full = asyncio.Event()
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.ensure_future(self.run())
+
+    async def submit(self, data):
+        future = asyncio.get_event_loop().create_future()
+        self.queue.put_nowait((data, future))
+        # The scheduler already holds the first request of the batch it is collecting
+        if self.queue.qsize() >= self.max_batch_size - 1:
+            self.batch_full.set()
+        return await future
+
+    def fill(self, batch):
+        while len(batch) < self.max_batch_size and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        # Callers that disconnected or timed out while waiting no longer need a result
+        return [(data, future) for data, future in batch if not future.cancelled()]
+
+    async def collect(self):
+        batch = [await self.queue.get()]
+        if self.queue.qsize() < self.max_batch_size - 1:
+            self.batch_full.clear()
+            try:
+                await asyncio.wait_for(self.batch_full.wait(), self.max_wait)
+            except asyncio.TimeoutError:
+                pass
+        return self.fill(batch)
+
+    async def run(self):
+        while True:
+            batch = await self.collect()
+            if not batch:
+                continue
+
+            replica = await self.replicas.acquire()
+            # Requests that arrived while waiting for a replica can join the batch
+            batch = self.fill(batch)
+            if not batch:
+                self.replicas.release(replica)
+                continue
+            asyncio.ensure_future(self.run_on_replica(replica, batch))
+
+    async def run_on_replica(self, replica, batch):
+        try:
+            results = await asyncio.get_event_loop().run_in_executor(
+                self.executor, self.run_batch, replica.model, [data for data, _ in batch]
+            )
+            if len(results) != len(batch):
+                raise ValueError(
+                    "Expected {} batch results, got {}".format(len(batch), len(results))
+                )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self.replicas.release(replica)
+
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
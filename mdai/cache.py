@@ -0,0 +1,192 @@
+import hashlib
+import os
+import struct
+import tempfile
+import threading
+from collections import OrderedDict
+import msgpack
+
+# On-disk entries start with the number of outputs they hold
+COUNT_FORMAT = ">I"
+COUNT_SIZE = struct.calcsize(COUNT_FORMAT)
+
+
+class ResultCache:
+    """
+    Cache of packed model outputs, keyed by a digest of the inputs that produced them.
+
+    Each entry is a `(count, elements)` tuple, where `elements` is the concatenation of the
+    msgpack-serialized outputs, so entries can be joined into a single response without repacking.
+    Entries are kept in memory up to `max_bytes`, evicting the least recently used ones. If
+    `directory` is given, entries are also written there, up to `max_disk_bytes` (unbounded if 0),
+    and entries missing from memory are looked up on disk. Methods are thread-safe.
+    """
+
+    def __init__(self, max_bytes, directory=None, max_disk_bytes=0):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.disk_entries = OrderedDict()
+        self.disk_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            paths = [os.path.join(directory, name) for name in os.listdir(directory)]
+            for path in sorted(paths, key=os.path.getmtime):
+                if not path.endswith(".tmp"):
+                    self.disk_entries[os.path.basename(path)] = os.path.getsize(path)
+            self.disk_bytes = sum(self.disk_entries.values())
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            if key not in self.disk_entries:
+                self.misses += 1
+                return None
+            self.disk_entries.move_to_end(key)
+
+        try:
+            entry = self.read(key)
+        except OSError:
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.disk_hits += 1
+            self.store(key, entry)
+        return entry
+
+    def put(self, key, entry):
+        with self.lock:
+            self.store(key, entry)
+            write = self.directory is not None and key not in self.disk_entries
+        if write:
+            self.write(key, entry)
+
+    def store(self, key, entry):
+        size = len(entry[1])
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self.bytes -= len(self.entries.pop(key)[1])
+        self.entries[key] = entry
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, elements) = self.entries.popitem(last=False)
+            self.bytes -= len(elements)
+
+    def read(self, key):
+        with open(os.path.join(self.directory, key), "rb") as f:
+            (count,) = struct.unpack(COUNT_FORMAT, f.read(COUNT_SIZE))
+            return count, f.read()
+
+    def write(self, key, entry):
+        count, elements = entry
+        path = os.path.join(self.directory, key)
+        # Unique across threads and the processes sharing the directory
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=key + ".", suffix=".tmp")
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(struct.pack(COUNT_FORMAT, count))
+                f.write(elements)
+            os.replace(temp_path, path)
+        except OSError:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return
+
+        evicted = []
+        with self.lock:
+            if key not in self.disk_entries:
+                self.disk_entries[key] = COUNT_SIZE + len(elements)
+                self.disk_bytes += COUNT_SIZE + len(elements)
+            while self.max_disk_bytes and self.disk_bytes > self.max_disk_bytes:
+                evicted_key, size = self.disk_entries.popitem(last=False)
+                self.disk_bytes -= size
+                evicted.append(evicted_key)
+        for evicted_key in evicted:
+            try:
+                os.remove(os.path.join(self.directory, evicted_key))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "disk_entries": len(self.disk_entries),
+                "disk_bytes": self.disk_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
+
+
+def pack_entry(outputs, default=None):
+    """Serialize a list of outputs into a cache entry, using msgpack's `default` hook if given."""
+    packer = msgpack.Packer(use_bin_type=True, default=default)
+    return len(outputs), b"".join(packer.pack(output) for output in outputs)
+
+
+def join_entries(entries):
+    """Join cache entries into the msgpack-serialized list of all of their outputs."""
+    count = sum(entry[0] for entry in entries)
+    header = msgpack.Packer().pack_array_header(count)
+    return b"".join([header] + [entry[1] for entry in entries])
+
+
+def digest_file(file):
+    digest = hashlib.sha256()
+    for key in sorted(file):
+        value = file[key]
+        if key == "content" and value is not None:
+            digest.update(b"content")
+            digest.update(value.encode("utf-8") if isinstance(value, str) else value)
+        else:
+            digest.update(msgpack.packb([key, value], use_bin_type=True))
+    return digest.digest()
+
+
+def digest_context(version, data):
+    """Digest of the model version and every part of the request other than its files."""
+    digest = hashlib.sha256(version.encode("utf-8"))
+    for key in sorted(data):
+        if key != "files":
+            digest.update(msgpack.packb([key, data[key]], use_bin_type=True))
+    return digest
+
+
+def request_key(version, data):
+    """Cache key for the outputs of a whole request."""
+    digest = digest_context(version, data)
+    for file in data.get("files", []):
+        digest.update(digest_file(file))
+    return digest.hexdigest()
+
+
+def file_keys(version, data):
+    """Cache keys for the outputs of each file of a request, run on its own."""
+    context = digest_context(version, data)
+    keys = []
+    for file in data.get("files", []):
+        digest = context.copy()
+        digest.update(b"file")
+        digest.update(digest_file(file))
+        keys.append(digest.hexdigest())
+    return keys
@@ -0,0 +1,268 @@
+import io
+import re
+import struct
+import numpy as np
+import pydicom
+from pydicom.datadict import tag_for_keyword
+from pydicom.tag import Tag
+
+try:
+    from pydicom.encaps import generate_frames
+except ImportError:  # pydicom < 3
+    from pydicom.encaps import generate_pixel_data_frame as generate_frames
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+DICOM_CONTENT_TYPE = "application/dicom"
+
+# Transfer syntaxes that Pillow can decode at a reduced resolution
+JPEG_BASELINE = "1.2.840.10008.1.2.4.50"
+JPEG_2000 = {"1.2.840.10008.1.2.4.90", "1.2.840.10008.1.2.4.91"}
+
+# JPEG 2000 codestream markers
+J2K_SOC_SIZE = 2
+J2K_COD = 0xFF52
+
+# Elements from the first pixel data element onwards are not read by a header-only parse
+PIXEL_DATA_START = Tag(0x7FE0, 0x0008)
+
+
+class BufferReader(io.RawIOBase):
+    """Seekable read-only file over a buffer such as `bytes` or `mmap`, without copying it."""
+
+    def __init__(self, buffer):
+        self.view = memoryview(buffer).cast("B")
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        size = max(0, min(len(b), len(self.view) - self.position))
+        b[:size] = self.view[self.position : self.position + size]
+        self.position += size
+        return size
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += len(self.view)
+        if offset < 0:
+            raise ValueError("Negative seek position {}".format(offset))
+        self.position = offset
+        return self.position
+
+    def tell(self):
+        return self.position
+
+
+class LazyDataset:
+    """
+    View over the content of a DICOM file that is only parsed when used.
+
+    Tags are read from a header-only parse (`stop_before_pixels`) made on first access. The whole
+    file is parsed the first time pixel data, or any element stored after it, is accessed, and is
+    then used for every access. Other `pydicom.Dataset` attributes and methods are those of the
+    header until then. `dataset` returns the complete `pydicom.Dataset`.
+
+    The content is read through a `memoryview`, so it is never copied as a whole.
+    """
+
+    def __init__(self, content):
+        self.content = content
+        self._header = None
+        self._dataset = None
+
+    def read(self, stop_before_pixels):
+        return pydicom.dcmread(BufferReader(self.content), stop_before_pixels=stop_before_pixels)
+
+    @property
+    def header(self):
+        if self._header is None:
+            self._header = self.read(stop_before_pixels=True)
+        return self._header
+
+    @property
+    def dataset(self):
+        if self._dataset is None:
+            self._dataset = self.read(stop_before_pixels=False)
+            self._header = self._dataset
+        return self._dataset
+
+    def source(self, tag):
+        """The dataset holding `tag`, loading the whole file if it is not in the header."""
+        if self._dataset is None and tag < PIXEL_DATA_START:
+            return self.header
+        return self.dataset
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if name == "pixel_array":
+            return self.dataset.pixel_array
+        tag = tag_for_keyword(name)
+        if tag is None:
+            return getattr(self.header, name)
+        return getattr(self.source(Tag(tag)), name)
+
+    def __getitem__(self, key):
+        return self.source(Tag(key))[key]
+
+    def __contains__(self, key):
+        return key in self.source(Tag(key))
+
+    def get(self, key, default=None):
+        return self.source(Tag(key)).get(key, default)
+
+
+def lazy_datasets(files):
+    """A `LazyDataset` for each DICOM file of a request, in order, or None for other files."""
+    return [
+        LazyDataset(file["content"]) if file.get("content_type") == DICOM_CONTENT_TYPE else None
+        for file in files
+    ]
+
+
+def parse_size(value):
+    """Parse an image size such as '224', '224,224' or '[224, 224]' into (rows, columns)."""
+    sizes = [int(size) for size in re.findall(r"\d+", value)]
+    if len(sizes) == 1:
+        return sizes[0], sizes[0]
+    if len(sizes) == 2:
+        return sizes[0], sizes[1]
+    if not sizes:
+        return None
+    raise ValueError("Invalid image size '{}', expected rows and columns".format(value))
+
+
+def reduction_factor(rows, columns, size):
+    """Largest power of two an image can be reduced by while staying at least `size`."""
+    factor = 1
+    while -(-rows // (factor * 2)) >= size[0] and -(-columns // (factor * 2)) >= size[1]:
+        factor *= 2
+    return factor
+
+
+def reduce_image(image, factor):
+    """Downsample the first two axes of an image by averaging blocks of `factor` pixels."""
+    rows, columns = image.shape[:2]
+    reduced_rows, reduced_columns = -(-rows // factor), -(-columns // factor)
+    padding = [(0, reduced_rows * factor - rows), (0, reduced_columns * factor - columns)]
+    padded = np.pad(image, padding + [(0, 0)] * (image.ndim - 2), mode="edge")
+    blocks = padded.reshape((reduced_rows, factor, reduced_columns, factor) + image.shape[2:])
+    reduced = blocks.mean(axis=(1, 3))
+    if np.issubdtype(image.dtype, np.integer):
+        reduced = np.rint(reduced)
+    return reduced.astype(image.dtype)
+
+
+def j2k_levels(codestream):
+    """Number of wavelet decomposition levels of a JPEG 2000 codestream, from its COD segment."""
+    position = J2K_SOC_SIZE
+    while position + 4 <= len(codestream):
+        marker, length = struct.unpack(">HH", codestream[position : position + 4])
+        if marker == J2K_COD:
+            # Marker, length, coding style and the four SGcod bytes precede the level count
+            return codestream[position + 9]
+        position += 2 + length
+    return 0
+
+
+def codec_decode(ds, factor):
+    """
+    Decode a single-frame image at a reduced resolution with Pillow: by DCT scaling for baseline
+    JPEG, down to 1/8, and by dropping resolution levels for JPEG 2000. Returns the image and the
+    factor it was reduced by, or None if the dataset's encoding is not supported.
+    """
+    if Image is None or factor == 1 or int(ds.get("NumberOfFrames") or 1) != 1:
+        return None
+    syntax = ds.file_meta.TransferSyntaxUID
+    if syntax == JPEG_BASELINE and ds.BitsAllocated == 8:
+        image = Image.open(io.BytesIO(next(generate_frames(ds.PixelData))))
+        image.draft(image.mode, (-(-ds.Columns // factor), -(-ds.Rows // factor)))
+    elif syntax in JPEG_2000 and ds.PixelRepresentation == 0:
+        codestream = next(generate_frames(ds.PixelData))
+        image = Image.open(io.BytesIO(codestream))
+        image.reduce = min(factor.bit_length() - 1, j2k_levels(codestream))
+    else:
+        return None
+    pixels = np.asarray(image)
+    return pixels, max(1, round(ds.Columns / pixels.shape[1]))
+
+
+def decode_reduced(ds, size):
+    """
+    Decode the pixel data of a dataset at a reduced resolution, for models that downsample their
+    input to `size` (rows, columns). The image is reduced by the largest power of two that keeps
+    it at least `size`, using the codec's own reduced-resolution decoding where the transfer
+    syntax allows, and otherwise by averaging blocks of the fully decoded image. The image still
+    needs resizing to exactly `size`. Multi-frame images are reduced frame by frame.
+    """
+    if isinstance(ds, LazyDataset):
+        ds = ds.dataset
+    factor = reduction_factor(ds.Rows, ds.Columns, size)
+    try:
+        decoded = codec_decode(ds, factor)
+    except Exception:
+        # Pillow may be built without support for the codec
+        decoded = None
+    if decoded is None:
+        pixels, factor_done = ds.pixel_array, 1
+    else:
+        pixels, factor_done = decoded
+
+    remaining = factor // factor_done
+    if remaining > 1:
+        if int(ds.get("NumberOfFrames") or 1) > 1:
+            frames = np.moveaxis(pixels, 0, 2)
+            pixels = np.moveaxis(reduce_image(frames, remaining), 2, 0)
+        else:
+            pixels = reduce_image(pixels, remaining)
+    return pixels
+
+
+def decode_dataset(content, size=None):
+    """
+    Parse a DICOM file and decode its pixel data. Returns the dataset and its pixel data, which is
+    also cached as `pixel_array`, or if `size` is given, decoded with `decode_reduced` instead.
+    """
+    reader = BufferReader(content)
+    ds = pydicom.dcmread(reader)
+    # The dataset keeps the file it was read from (`filename` in pydicom 2, `buffer` in pydicom 3),
+    # whose view of the content can not be pickled to return the dataset from a worker process
+    for name in ("filename", "buffer"):
+        if ds.__dict__.get(name) is reader:
+            ds.__dict__[name] = None
+    if "PixelData" not in ds:
+        return ds, None
+    if size is not None:
+        return ds, decode_reduced(ds, size)
+    return ds, ds.pixel_array
+
+
+def decode_datasets(files, executor, copy_content=False, size=None):
+    """
+    Decode the DICOM files of a request concurrently on `executor`. Returns a list with the
+    dataset and pixel data of each file, in order, as returned by `decode_dataset`, or None for
+    files that are not DICOM.
+
+    `copy_content` must be set for a process pool, to send file contents that are not `bytes` or
+    `bytearray`, such as spooled `mmap` contents, to worker processes.
+    """
+    futures = []
+    for file in files:
+        if file.get("content_type") != DICOM_CONTENT_TYPE:
+            futures.append(None)
+            continue
+        content = file["content"]
+        if copy_content and not isinstance(content, (bytes, bytearray)):
+            content = bytes(content)
+        futures.append(executor.submit(decode_dataset, content, size))
+    return [future.result() if future is not None else None for future in futures]
@@ -0,0 +1,242 @@
+import os
+import tempfile
+from contextlib import contextmanager
+from itertools import islice
+import numpy as np
+import pydicom
+from pydicom.encaps import encapsulate
+from pydicom.uid import UID
+
+from dicom import DICOM_CONTENT_TYPE, BufferReader, generate_frames
+
+try:
+    from pydicom.pixels.utils import pixel_dtype
+except ImportError:  # pydicom < 3
+    from pydicom.pixel_data_handlers.util import pixel_dtype
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+try:
+    import av
+except ImportError:
+    av = None
+
+# Transfer syntaxes whose pixel data is a single MPEG or HEVC video stream
+VIDEO_TRANSFER_SYNTAXES = {
+    "1.2.840.10008.1.2.4.100",
+    "1.2.840.10008.1.2.4.101",
+    "1.2.840.10008.1.2.4.102",
+    "1.2.840.10008.1.2.4.103",
+    "1.2.840.10008.1.2.4.104",
+    "1.2.840.10008.1.2.4.105",
+    "1.2.840.10008.1.2.4.106",
+    "1.2.840.10008.1.2.4.107",
+    "1.2.840.10008.1.2.4.108",
+}
+
+# Image pixel module elements needed to decode a frame on its own
+FRAME_KEYWORDS = (
+    "Rows",
+    "Columns",
+    "SamplesPerPixel",
+    "BitsAllocated",
+    "BitsStored",
+    "HighBit",
+    "PixelRepresentation",
+    "PhotometricInterpretation",
+    "PlanarConfiguration",
+)
+
+
+def encapsulated_frames(pixel_data, count):
+    try:
+        return generate_frames(pixel_data, number_of_frames=count)
+    except TypeError:  # pydicom < 3
+        return generate_frames(pixel_data, nr_frames=count)
+
+
+def frame_dataset(ds, frame):
+    """A single-frame dataset holding one encapsulated `frame` of `ds`, to decode it on its own."""
+    single = pydicom.Dataset()
+    single.file_meta = ds.file_meta
+    for keyword in FRAME_KEYWORDS:
+        if keyword in ds:
+            setattr(single, keyword, ds[keyword].value)
+    single.NumberOfFrames = 1
+    single.add_new(0x7FE00010, "OB", encapsulate([frame]))
+    single["PixelData"].is_undefined_length = True
+    return single
+
+
+def native_frames(ds, count):
+    """
+    Views over each frame of uncompressed pixel data, or None if frames can not be sliced from it
+    directly, such as for 1 bit or YBR_FULL_422 pixel data.
+    """
+    if ds.BitsAllocated % 8 or ds.PhotometricInterpretation == "YBR_FULL_422":
+        return None
+    samples = int(ds.get("SamplesPerPixel", 1))
+    planar = samples > 1 and ds.get("PlanarConfiguration", 0) == 1
+    dtype = pixel_dtype(ds)
+    pixels = int(ds.Rows) * int(ds.Columns) * samples
+    if samples == 1:
+        shape = (ds.Rows, ds.Columns)
+    elif planar:
+        shape = (samples, ds.Rows, ds.Columns)
+    else:
+        shape = (ds.Rows, ds.Columns, samples)
+
+    def frame(index):
+        array = np.frombuffer(
+            ds.PixelData, dtype=dtype, count=pixels, offset=index * pixels * dtype.itemsize
+        ).reshape(shape)
+        return np.moveaxis(array, 0, 2) if planar else array
+
+    return (frame(index) for index in range(count))
+
+
+def dicom_frames(content, start=0, stride=1, keyframes_only=False):
+    """
+    Iterate over the frames of a DICOM file, starting at frame `start` and then every `stride`
+    frames. Yields the frame number and pixel data of each frame, with the same shape and dtype
+    as a frame of `pixel_array`.
+
+    Encapsulated (compressed) frames are decoded one at a time, and only if they are yielded, and
+    uncompressed frames are read-only views over the pixel data, so only the frames in use are
+    held in memory. Pixel data that is a video stream, such as MPEG-4, is read with
+    `video_frames`, and `keyframes_only` applies to it.
+    """
+    ds = pydicom.dcmread(BufferReader(content))
+    if "PixelData" not in ds:
+        return
+    count = int(ds.get("NumberOfFrames") or 1)
+    syntax = UID(ds.file_meta.TransferSyntaxUID)
+
+    if syntax in VIDEO_TRANSFER_SYNTAXES:
+        stream = next(encapsulated_frames(ds.PixelData, 1))
+        yield from video_frames(stream, start=start, stride=stride, keyframes_only=keyframes_only)
+        return
+
+    if syntax.is_compressed:
+        # Frames are selected before they are decoded
+        encapsulated = islice(
+            enumerate(encapsulated_frames(ds.PixelData, count)), start, None, stride
+        )
+        for index, frame in encapsulated:
+            yield index, frame_dataset(ds, frame).pixel_array
+        return
+
+    frames = native_frames(ds, count)
+    if frames is None:
+        pixels = ds.pixel_array
+        frames = pixels if count > 1 else [pixels]
+    yield from islice(enumerate(frames), start, None, stride)
+
+
+@contextmanager
+def video_file(content):
+    """
+    Path to a file holding `content`, for video readers that need one. The file is in memory
+    (memfd) where supported, and a temporary file otherwise.
+    """
+    if hasattr(os, "memfd_create"):
+        fd = os.memfd_create("mdai-video")
+        path = "/proc/self/fd/{}".format(fd)
+    else:
+        fd, path = tempfile.mkstemp()
+    try:
+        with os.fdopen(fd, "wb", closefd=False) as video:
+            video.write(content)
+        yield path
+    finally:
+        os.close(fd)
+        if not path.startswith("/proc/"):
+            os.unlink(path)
+
+
+def keyframes(content, start=0, stride=1):
+    """Decode only the key frames of a video with PyAV, skipping all others without decoding."""
+    if av is None:
+        raise ImportError("Reading the key frames of a video requires PyAV (av)")
+    with av.open(BufferReader(content)) as container:
+        stream = container.streams.video[0]
+        stream.codec_context.skip_frame = "NONKEY"
+        rate = stream.average_rate or stream.guessed_rate
+        keyframe_index = 0
+        for frame in container.decode(stream):
+            index = int(round(frame.time * rate)) if frame.time is not None else frame.index
+            if index < start:
+                continue
+            if keyframe_index % stride == 0:
+                yield index, frame.to_ndarray(format="bgr24")
+            keyframe_index += 1
+
+
+def video_frames(content, start=0, stride=1, keyframes_only=False):
+    """
+    Iterate over the frames of a video file held in memory, starting at frame `start` and then
+    every `stride` frames. Yields the frame number and the BGR image of each frame, as read by
+    OpenCV.
+
+    Skipped frames are not converted to images. With `keyframes_only`, only key frames are
+    decoded, using PyAV, and `stride` counts key frames.
+    """
+    if keyframes_only:
+        yield from keyframes(content, start=start, stride=stride)
+        return
+    if cv2 is None:
+        raise ImportError("Reading video frames requires OpenCV (opencv-python)")
+
+    with video_file(content) as path:
+        capture = cv2.VideoCapture(path)
+        if not capture.isOpened():
+            raise ValueError("Could not open video")
+        try:
+            if start:
+                capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+            index = start
+            while capture.grab():
+                if (index - start) % stride == 0:
+                    ok, frame = capture.retrieve()
+                    if not ok:
+                        break
+                    yield index, frame
+                index += 1
+        finally:
+            capture.release()
+
+
+def chunk_frames(frames, chunk_size):
+    """
+    Group frames from `dicom_frames` or `video_frames` into chunks of up to `chunk_size` frames.
+    Yields the frame numbers of each chunk and its frames stacked into one array.
+    """
+    numbers, chunk = [], []
+    for number, frame in frames:
+        numbers.append(number)
+        chunk.append(frame)
+        if len(chunk) == chunk_size:
+            yield numbers, np.stack(chunk)
+            numbers, chunk = [], []
+    if chunk:
+        yield numbers, np.stack(chunk)
+
+
+def iter_frames(file, start=0, stride=1, keyframes_only=False, chunk_size=None):
+    """
+    Iterate over the frames of a file of a request, a multi-frame DICOM file or a video, without
+    decoding them all at once. Yields the frame number and image of each frame, or with a
+    `chunk_size`, the frame numbers and stacked images of chunks of frames. Frames of DICOM files
+    that are not a video stream are all key frames.
+    """
+    if file.get("content_type") == DICOM_CONTENT_TYPE:
+        read_frames = dicom_frames
+    else:
+        read_frames = video_frames
+    frames = read_frames(file["content"], start=start, stride=stride, keyframes_only=keyframes_only)
+    if chunk_size:
+        return chunk_frames(frames, chunk_size)
+    return frames
@@ -0,0 +1,59 @@
+import numpy as np
+
+# Run lengths are serialized as little-endian unsigned 32-bit integers
+RLE_DTYPE = np.dtype("<u4")
+
+
+def encode_mask(mask, encoding="bitpack"):
+    """
+    Encode a 2D binary mask for the `mask` field of an output's `data`, as an alternative to
+    a nested Python list. Nonzero values are treated as part of the mask.
+
+    - 'bitpack': one bit per pixel in row-major order, most significant bit first, padded with zeros
+      to a whole number of bytes. Best for masks with fine detail.
+    - 'rle': lengths of alternating runs of 0 and 1 pixels in row-major order, starting with a
+      (possibly empty) run of 0s, as little-endian uint32 values. Best for large regions.
+    """
+    mask = np.asarray(mask)
+    if mask.ndim != 2:
+        raise ValueError("Mask needs to be a 2D array, got {} dimensions".format(mask.ndim))
+    flat = mask.ravel() != 0
+
+    if encoding == "bitpack":
+        data = np.packbits(flat).tobytes()
+    elif encoding == "rle":
+        changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+        boundaries = np.concatenate(([0], changes, [flat.size]))
+        counts = np.diff(boundaries)
+        if flat.size and flat[0]:
+            counts = np.concatenate(([0], counts))
+        data = counts.astype(RLE_DTYPE).tobytes()
+    else:
+        raise ValueError("Unknown mask encoding '{}'".format(encoding))
+
+    return {
+        "encoding": encoding,
+        "shape": [int(size) for size in mask.shape],
+        "dtype": str(mask.dtype),
+        "data": data,
+    }
+
+
+def decode_mask(encoded):
+    """Decode a mask produced by `encode_mask` into a numpy array of its original dtype."""
+    shape = tuple(encoded["shape"])
+    size = shape[0] * shape[1]
+    dtype = np.dtype(encoded["dtype"])
+
+    if encoded["encoding"] == "bitpack":
+        flat = np.unpackbits(np.frombuffer(encoded["data"], dtype=np.uint8), count=size)
+    elif encoded["encoding"] == "rle":
+        counts = np.frombuffer(encoded["data"], dtype=RLE_DTYPE)
+        if int(counts.sum()) != size:
+            raise ValueError("Mask run lengths do not add up to the mask size")
+        values = np.arange(len(counts)) % 2
+        flat = np.repeat(values.astype(np.uint8), counts)
+    else:
+        raise ValueError("Unknown mask encoding '{}'".format(encoded["encoding"]))
+
+    return flat.reshape(shape).astype(dtype, copy=False)
@@ -0,0 +1,53 @@
+import ctypes
+import ctypes.util
+import gc
+import os
+import resource
+import tracemalloc
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def load_malloc_trim():
+    """glibc's `malloc_trim`, or None with other C libraries."""
+    try:
+        return ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6").malloc_trim
+    except (OSError, AttributeError):
+        return None
+
+
+malloc_trim = load_malloc_trim()
+
+
+def current_rss():
+    """Resident memory of this process in bytes, or 0 where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        return 0
+
+
+def peak_rss():
+    """Peak resident memory of this process in bytes."""
+    # Reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def traced_memory():
+    """Current and peak size in bytes of the memory traced by tracemalloc, or zeros if off."""
+    if not tracemalloc.is_tracing():
+        return 0, 0
+    return tracemalloc.get_traced_memory()
+
+
+def reclaim_memory():
+    """
+    Collect garbage, then return free heap memory to the operating system with `malloc_trim`
+    where available. Returns the number of bytes the resident memory shrank by.
+    """
+    before = current_rss()
+    gc.collect()
+    if malloc_trim is not None:
+        malloc_trim(0)
+    return max(before - current_rss(), 0)
@@ -0,0 +1,221 @@
+import bisect
+import time
+import uuid
+from contextlib import contextmanager
+
+from memory import current_rss, peak_rss, traced_memory
+
+# Histogram buckets, as upper bounds
+SECONDS_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    120,
+)
+BYTES_BUCKETS = tuple(1024 * 4**power for power in range(12))
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+def format_labels(names, values, extra=""):
+    pairs = ['{}="{}"'.format(name, value) for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+
+    def header(self):
+        return [
+            "# HELP {} {}".format(self.name, self.documentation),
+            "# TYPE {} {}".format(self.name, self.type),
+        ]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self.values = {}
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = self.header()
+        for label_values, value in sorted(self.values.items()):
+            labels = format_labels(self.labels, label_values)
+            lines.append("{}{} {}".format(self.name, labels, format_value(value)))
+        return lines
+
+
+class Gauge(Metric):
+    """
+    Gauge whose value is read from `function` when the metrics are collected. With `labels`,
+    `function` returns a dict of values by tuple of label values.
+    """
+
+    type = "gauge"
+
+    def __init__(self, name, documentation, function, labels=()):
+        super().__init__(name, documentation, labels)
+        self.function = function
+
+    def render(self):
+        values = self.function() if self.labels else {(): self.function()}
+        lines = self.header()
+        for label_values, value in sorted(values.items()):
+            labels = format_labels(self.labels, label_values)
+            lines.append("{}{} {}".format(self.name, labels, format_value(value)))
+        return lines
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, buckets, labels=()):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        self.series = {}
+
+    def observe(self, value, *label_values):
+        series = self.series.get(label_values)
+        if series is None:
+            # Count of each bucket, with one for values above the last bound, then the sum
+            series = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self):
+        lines = self.header()
+        for label_values, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                labels = format_labels(
+                    self.labels, label_values, 'le="{}"'.format(format_value(bound))
+                )
+                lines.append("{}_bucket{} {}".format(self.name, labels, cumulative))
+            labels = format_labels(self.labels, label_values)
+            lines.append("{}_sum{} {}".format(self.name, labels, format_value(series[-1])))
+            lines.append("{}_count{} {}".format(self.name, labels, cumulative))
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Metrics of a server process, rendered in the Prometheus text exposition format. Metrics are
+    updated from the event loop only, so they need no locking.
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, function, labels=()):
+        return self.register(Gauge(name, documentation, function, labels))
+
+    def histogram(self, name, documentation, buckets, labels=()):
+        return self.register(Histogram(name, documentation, buckets, labels))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class RequestStats:
+    """
+    Measurements of an inference request: seconds spent in each phase of its handling, in the
+    order they started, the sizes of its body and response, its number of files and outputs, and
+    its memory use.
+
+    The resident memory of the process, and the memory traced by tracemalloc when it is tracing,
+    are sampled at the end of each phase, and `rss_peak` and `traced_peak` are the highest
+    samples. Both include the memory of concurrent requests.
+    """
+
+    def __init__(self, request_id=None):
+        self.request_id = request_id or uuid.uuid4().hex
+        self.scope = None
+        self.phases = {}
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.files = None
+        self.outputs = None
+        self.started = time.perf_counter()
+        self.started_peak_rss = peak_rss()
+        self.rss_start = self.rss_peak = current_rss()
+        self.traced_start = self.traced_peak = traced_memory()[0]
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+        self.rss_peak = max(self.rss_peak, current_rss())
+        self.traced_peak = max(self.traced_peak, traced_memory()[0])
+
+    @contextmanager
+    def time(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start)
+
+    def server_timing(self):
+        """Value of a `Server-Timing` header with the phases so far and the total, in ms."""
+        timings = list(self.phases.items()) + [("total", time.perf_counter() - self.started)]
+        return ", ".join("{};dur={:.3f}".format(phase, seconds * 1e3) for phase, seconds in timings)
+
+    def log_record(self, status):
+        """
+        Access log record of the request. The peak RSS delta is how much the process's peak
+        resident memory grew while the request was handled, which concurrent requests add to.
+        """
+        return {
+            "request_id": self.request_id,
+            "status": status,
+            "scope": self.scope,
+            "files": self.files,
+            "request_bytes": self.request_bytes,
+            "response_bytes": self.response_bytes,
+            "outputs": self.outputs,
+            "phases_ms": {phase: round(seconds * 1e3, 3) for phase, seconds in self.phases.items()},
+            "total_ms": round((time.perf_counter() - self.started) * 1e3, 3),
+            "peak_rss_delta_bytes": peak_rss() - self.started_peak_rss,
+            "rss_start_bytes": self.rss_start,
+            "rss_peak_bytes": self.rss_peak,
+            "traced_start_bytes": self.traced_start,
+            "traced_peak_bytes": self.traced_peak,
+        }
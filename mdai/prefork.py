@@ -0,0 +1,63 @@
+import os
+import signal
+import time
+import traceback
+import logging
+
+logger = logging.getLogger("model")
+
+# Minimum time between restarts of worker processes that exited unexpectedly
+RESTART_DELAY_SECONDS = 1
+
+
+def run_workers(num_workers, target):
+    """
+    Fork `num_workers` processes that each run `target`, and supervise them until SIGTERM or
+    SIGINT is received, which is forwarded to the workers.
+
+    Everything loaded in the parent before this is called, such as the model, is shared with the
+    workers copy-on-write. Workers that exit unexpectedly are restarted from the parent's state.
+    """
+    workers = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            exit_code = 0
+            try:
+                target()
+            except BaseException:
+                traceback.print_exc()
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        workers.add(pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(num_workers):
+        spawn()
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        workers.discard(pid)
+        if not stopping:
+            logger.warning(f"Worker {pid} exited with status {status}, restarting")
+            time.sleep(RESTART_DELAY_SECONDS)
+            spawn()
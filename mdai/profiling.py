@@ -0,0 +1,162 @@
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+CPROFILE = "cprofile"
+SAMPLE = "sample"
+TRACEMALLOC = "tracemalloc"
+MODES = (CPROFILE, SAMPLE, TRACEMALLOC)
+
+# Seconds between stack samples
+SAMPLE_INTERVAL = 0.005
+
+# Frames kept per allocation traceback in tracemalloc mode
+TRACEMALLOC_FRAMES = 10
+
+# Longest time a capture can run for
+MAX_SECONDS = 600
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return "{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename), frame.f_lineno)
+
+
+class ProfileCapture:
+    """
+    Profile of the server over the next `requests` inference requests, or over `seconds`, for at
+    most `MAX_SECONDS`. Only one capture can run at a time.
+
+    - 'cprofile': blocking calls made for requests, such as `predict`, are run under cProfile,
+      and the profiles are combined into a pstats report of the `top` functions, by cumulative
+      time. A call that starts while another is profiled, which Python 3.12 does not allow, is run
+      without profiling.
+    - 'sample': the stacks of all threads are sampled every `SAMPLE_INTERVAL` seconds and
+      reported as collapsed stacks (one `thread;outer;...;inner count` line per stack), the input
+      format of flamegraph tools.
+    - 'tracemalloc': memory allocations are traced, and the `top` allocation sites whose memory
+      held grew the most over the capture are reported with their tracebacks.
+    """
+
+    def __init__(self, mode, requests=None, seconds=None, top=50):
+        if mode not in MODES:
+            raise ValueError("Unknown profile mode '{}', expected one of {}".format(mode, MODES))
+        if not requests and not seconds:
+            raise ValueError("A number of requests or of seconds to profile is needed")
+        self.mode = mode
+        self.requests = requests
+        self.seconds = seconds
+        self.top = top
+        self.completed = 0
+        self.skipped = 0
+        self.stats = None
+        self.samples = Counter()
+        self.lock = threading.Lock()
+        self.done = None
+        self.sampler = None
+        self.started_tracing = False
+        self.snapshot = None
+
+    def start(self):
+        self.done = asyncio.Event()
+        if self.mode == SAMPLE:
+            self.sampler = threading.Thread(target=self.sample, name="profiler", daemon=True)
+            self.sampler.start()
+        elif self.mode == TRACEMALLOC:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+                self.started_tracing = True
+            self.snapshot = tracemalloc.take_snapshot()
+
+    def request_done(self):
+        self.completed += 1
+        if self.requests and self.completed >= self.requests:
+            self.done.set()
+
+    async def wait(self):
+        """Wait until the requests were profiled or the capture's time is up."""
+        try:
+            await asyncio.wait_for(self.done.wait(), min(self.seconds or MAX_SECONDS, MAX_SECONDS))
+        except asyncio.TimeoutError:
+            pass
+        self.done.set()
+
+    def run(self, func, *args):
+        """Run a blocking call made for a request, profiling it in 'cprofile' mode."""
+        if self.mode != CPROFILE or self.done.is_set():
+            return func(*args)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another call is being profiled
+            with self.lock:
+                self.skipped += 1
+            return func(*args)
+        try:
+            return func(*args)
+        finally:
+            profile.disable()
+            with self.lock:
+                if self.stats is None:
+                    self.stats = pstats.Stats(profile, stream=io.StringIO())
+                else:
+                    self.stats.add(profile)
+
+    def sample(self):
+        own_id = threading.get_ident()
+        while not self.done.is_set():
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame_name(frame))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.samples[";".join(reversed(stack))] += 1
+            time.sleep(SAMPLE_INTERVAL)
+
+    def report(self):
+        """Stop profiling and return the report as text."""
+        header = "# mode={} requests={} skipped={}\n".format(
+            self.mode, self.completed, self.skipped
+        )
+        if self.mode == CPROFILE:
+            with self.lock:
+                if self.stats is None:
+                    return header + "No calls profiled\n"
+                stream = io.StringIO()
+                self.stats.stream = stream
+                self.stats.sort_stats("cumulative").print_stats(self.top)
+            return header + stream.getvalue()
+
+        if self.mode == SAMPLE:
+            self.sampler.join()
+            lines = ["{} {}".format(stack, count) for stack, count in self.samples.items()]
+            return header + "\n".join(sorted(lines)) + "\n"
+
+        snapshot = tracemalloc.take_snapshot()
+        if self.started_tracing:
+            tracemalloc.stop()
+        differences = snapshot.compare_to(self.snapshot, "traceback")[: self.top]
+        lines = [header]
+        for difference in differences:
+            lines.append(
+                "{:+.1f} KiB in {:+d} blocks, {:.1f} KiB in {} blocks held\n".format(
+                    difference.size_diff / 1024,
+                    difference.count_diff,
+                    difference.size / 1024,
+                    difference.count,
+                )
+            )
+            lines.extend("    {}\n".format(line) for line in difference.traceback.format())
+        return "".join(lines)
@@ -0,0 +1,94 @@
+import asyncio
+import time
+from collections import deque
+
+
+class Replica:
+    """A slot in a `ReplicaPool`, holding a model instance and its usage statistics."""
+
+    def __init__(self, index, model):
+        self.index = index
+        self.model = model
+        self.checkouts = 0
+        self.busy_seconds = 0.0
+        self.checked_out_at = None
+
+    def stats(self, elapsed):
+        busy_seconds = self.busy_seconds
+        if self.checked_out_at is not None:
+            busy_seconds += time.monotonic() - self.checked_out_at
+        return {
+            "replica": self.index,
+            "busy": self.checked_out_at is not None,
+            "checkouts": self.checkouts,
+            "busy_seconds": busy_seconds,
+            "utilization": busy_seconds / elapsed if elapsed > 0 else 0.0,
+        }
+
+
+class ReplicaPool:
+    """
+    Pool of model replicas, each checked out by one request at a time.
+
+    The same model instance may be given several times to allow concurrent calls on a model that
+    is thread-safe. A pool with a single replica serializes inference like a lock.
+    """
+
+    def __init__(self, models):
+        self.replicas = [Replica(index, model) for index, model in enumerate(models)]
+        self.idle = deque(self.replicas)
+        self.waiters = deque()
+        self.started_at = time.monotonic()
+
+    async def acquire(self, timeout=None):
+        """
+        Check out an idle replica, waiting for one to be released if needed. Raises
+        `asyncio.TimeoutError` if none became available within `timeout` seconds.
+        """
+        if self.idle and not self.waiters:
+            return self.checkout(self.idle.popleft())
+
+        loop = asyncio.get_event_loop()
+        waiter = loop.create_future()
+        self.waiters.append(waiter)
+        timer = None
+        if timeout is not None:
+            timer = loop.call_later(timeout, self.expire, waiter)
+        try:
+            return self.checkout(await waiter)
+        except BaseException:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+            elif waiter.done() and not waiter.cancelled() and waiter.exception() is None:
+                # A replica was handed over just as the request gave up on it
+                self.release_to_next(waiter.result())
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+    def expire(self, waiter):
+        if not waiter.done():
+            waiter.set_exception(asyncio.TimeoutError())
+
+    def checkout(self, replica):
+        replica.checked_out_at = time.monotonic()
+        return replica
+
+    def release(self, replica):
+        replica.busy_seconds += time.monotonic() - replica.checked_out_at
+        replica.checkouts += 1
+        replica.checked_out_at = None
+        self.release_to_next(replica)
+
+    def release_to_next(self, replica):
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(replica)
+                return
+        self.idle.append(replica)
+
+    def utilization(self):
+        elapsed = time.monotonic() - self.started_at
+        return [replica.stats(elapsed) for replica in self.replicas]
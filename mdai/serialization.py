@@ -0,0 +1,183 @@
+import asyncio
+import mmap
+import os
+import struct
+import tempfile
+import time
+import msgpack
+import numpy as np
+
+# Size of the reads the decoder makes from the request stream, and of the chunks used when
+# copying large file contents to a spool file
+READ_SIZE = 1024 * 1024
+
+# msgpack type headers for raw byte and string data, mapped to the size of their length field
+BIN_HEADERS = {0xC4: 1, 0xC5: 2, 0xC6: 4}
+STR_HEADERS = {0xD9: 1, 0xDA: 2, 0xDB: 4}
+LENGTH_FORMATS = {1: ">B", 2: ">H", 4: ">I"}
+
+
+class AsyncStreamReader:
+    """
+    Blocking file-like wrapper over an async byte stream, such as `request.stream()`.
+
+    `read` must be called from a thread other than the one running `loop`. Chunks are only
+    pulled from the stream as they are read, so the upload is consumed at the decoding pace.
+    `wait_seconds` is the time `read` spent waiting for chunks, and `bytes_read` their total size.
+    `on_chunk`, if given, is called on `loop` with `bytes_read` after each chunk, and may raise to
+    stop reading.
+    """
+
+    def __init__(self, stream, loop, on_chunk=None):
+        self.stream = stream.__aiter__()
+        self.loop = loop
+        self.on_chunk = on_chunk
+        self.buffer = b""
+        self.eof = False
+        self.wait_seconds = 0.0
+        self.bytes_read = 0
+
+    async def fill(self, size):
+        chunks = [self.buffer]
+        length = len(self.buffer)
+        while length < size:
+            try:
+                chunk = await self.stream.__anext__()
+            except StopAsyncIteration:
+                self.eof = True
+                break
+            chunks.append(chunk)
+            length += len(chunk)
+            self.bytes_read += len(chunk)
+            if self.on_chunk is not None:
+                self.on_chunk(self.bytes_read)
+        return b"".join(chunks)
+
+    def read(self, size=READ_SIZE):
+        if len(self.buffer) < size and not self.eof:
+            start = time.perf_counter()
+            self.buffer = asyncio.run_coroutine_threadsafe(self.fill(size), self.loop).result()
+            self.wait_seconds += time.perf_counter() - start
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+class RequestDecoder:
+    """
+    Incremental decoder for msgpack-serialized inference requests.
+
+    The top-level map and the `files` array are walked header by header, so each file's `content`
+    is materialized on its own as it arrives instead of after the whole body has been buffered.
+    Contents larger than `READ_SIZE` are returned as a `bytearray`, and contents larger than
+    `spool_threshold` bytes (when above 0) are written to an anonymous in-memory file and returned
+    as a read-only `mmap`. Both support the buffer protocol.
+    """
+
+    def __init__(self, file_like, spool_threshold=0):
+        self.unpacker = msgpack.Unpacker(
+            file_like, read_size=READ_SIZE, raw=False, max_buffer_size=0
+        )
+        self.spool_threshold = spool_threshold
+
+    def decode(self):
+        data = {}
+        for _ in range(self.unpacker.read_map_header()):
+            key = self.unpacker.unpack()
+            if key == "files":
+                data[key] = [self.decode_file() for _ in range(self.unpacker.read_array_header())]
+            else:
+                data[key] = self.unpacker.unpack()
+        return data
+
+    def decode_file(self):
+        file = {}
+        for _ in range(self.unpacker.read_map_header()):
+            key = self.unpacker.unpack()
+            if key == "content":
+                file[key] = self.read_content()
+            else:
+                file[key] = self.unpacker.unpack()
+        return file
+
+    def read_exactly(self, size):
+        data = self.unpacker.read_bytes(size)
+        if len(data) != size:
+            raise ValueError("Unexpected end of input data")
+        return data
+
+    def read_length(self, length_size):
+        return struct.unpack(LENGTH_FORMATS[length_size], self.read_exactly(length_size))[0]
+
+    def read_content(self):
+        header = self.read_exactly(1)[0]
+        if header == 0xC0:
+            return None
+        if header in BIN_HEADERS:
+            return self.read_bin(self.read_length(BIN_HEADERS[header]))
+        if 0xA0 <= header <= 0xBF:
+            return self.read_exactly(header & 0x1F).decode("utf-8")
+        if header in STR_HEADERS:
+            return self.read_exactly(self.read_length(STR_HEADERS[header])).decode("utf-8")
+        raise ValueError("Unsupported msgpack type 0x{:02x} for file content".format(header))
+
+    def read_bin(self, size):
+        if self.spool_threshold and size > self.spool_threshold:
+            return self.spool(size)
+        if size <= READ_SIZE:
+            return self.read_exactly(size)
+        # Copied chunk by chunk into its final buffer, so only one copy of the content is held
+        content = bytearray(size)
+        view = memoryview(content)
+        offset = 0
+        for chunk in self.read_chunks(size):
+            view[offset : offset + len(chunk)] = chunk
+            offset += len(chunk)
+        return content
+
+    def read_chunks(self, size):
+        while size > 0:
+            chunk = self.read_exactly(min(size, READ_SIZE))
+            size -= len(chunk)
+            yield chunk
+
+    def spool(self, size):
+        if hasattr(os, "memfd_create"):
+            spool_file = os.fdopen(os.memfd_create("mdai-content"), "w+b")
+        else:
+            spool_file = tempfile.TemporaryFile()
+        with spool_file:
+            for chunk in self.read_chunks(size):
+                spool_file.write(chunk)
+            spool_file.flush()
+            # The mapping stays valid after the file is closed
+            return mmap.mmap(spool_file.fileno(), size, access=mmap.ACCESS_READ)
+
+
+def decode_request_stream(file_like, spool_threshold=0):
+    return RequestDecoder(file_like, spool_threshold).decode()
+
+
+def encode_numpy(obj):
+    """
+    `default` hook for msgpack, serializing numpy scalars as the equivalent Python value, and
+    arrays as a map of their `dtype` (as a string such as '<f4'), `shape` and `data`, the raw
+    bytes of the array in C order. The bytes are packed straight from the array's buffer, without
+    converting its elements to Python objects.
+    """
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        if obj.dtype.hasobject:
+            return obj.tolist()
+        array = obj if obj.flags.c_contiguous else np.ascontiguousarray(obj)
+        return {
+            "dtype": array.dtype.str,
+            "shape": list(obj.shape),
+            "data": memoryview(array.reshape(-1)).cast("B"),
+        }
+    raise TypeError("Can not serialize {}".format(type(obj)))
+
+
+def decode_numpy(obj):
+    """Inverse of `encode_numpy` for a map of `dtype`, `shape` and `data`, for use by clients."""
+    return np.frombuffer(obj["data"], dtype=obj["dtype"]).reshape(obj["shape"])
@@ -1,13 +1,46 @@
 import sys
 import os
+import gc
+import hmac
+import json
 import logging
 import asyncio
+import multiprocessing
+import threading
+import time
 import traceback
+import tracemalloc
+from collections.abc import Iterator
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
 import msgpack
 from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from uvicorn import Config, Server
 
 from validation import OutputValidator
+from validation_policy import ValidationPolicy
+from batching import BatchScheduler
+from admission import AdmissionController, AdmissionRejected, get_deadline, time_remaining
+from serialization import AsyncStreamReader, decode_request_stream, encode_numpy
+from prefork import run_workers
+from replicas import ReplicaPool
+from cache import ResultCache, file_keys, join_entries, pack_entry, request_key
+from singleflight import SingleFlight
+from dicom import decode_datasets, lazy_datasets, parse_size
+from worker import WorkerModel
+from profiling import CPROFILE, ProfileCapture
+from memory import current_rss, peak_rss, reclaim_memory, traced_memory
+from metrics import (
+    BYTES_BUCKETS,
+    CONTENT_TYPE as METRICS_CONTENT_TYPE,
+    COUNT_BUCKETS,
+    SECONDS_BUCKETS,
+    MetricsRegistry,
+    RequestStats,
+)
 
 # To handle compressed DICOM image data
 import pylibjpeg
@@ -21,18 +54,526 @@ sys.path.insert(0, LIB_PATH)
 MDAI_PATH = os.path.join(LIB_PATH, os.environ["MDAI_PATH"])
 sys.path.insert(1, MDAI_PATH)
 
+# Sample inference request body run on each model replica before it is ready, unless the model
+# defines `warmup`
+WARMUP_PATH = os.path.join(MDAI_PATH, "warmup.msgpack")
+
 logger = logging.getLogger("model")
 logger.setLevel(logging.INFO)
 
+# One JSON line per inference request, written to stdout as is
+access_logger = logging.getLogger("access")
+access_logger.setLevel(logging.INFO)
+access_logger.propagate = False
+access_handler = logging.StreamHandler(sys.stdout)
+access_handler.setFormatter(logging.Formatter("%(message)s"))
+access_logger.addHandler(access_handler)
+
+# Number of pre-forked server processes sharing the model loaded in the parent process
+WORKERS = int(os.environ.get("MDAI_WORKERS", "1"))
+
+# Number of requests run concurrently on separate model replicas within each server process.
+# Models setting `thread_safe = True` share one instance between replicas
+MODEL_REPLICAS = int(os.environ.get("MDAI_MODEL_REPLICAS", "1"))
+
+# Micro-batching of INSTANCE scope requests, only enabled when the max batch size is above 1
+MAX_BATCH_SIZE = int(os.environ.get("MDAI_MAX_BATCH_SIZE", "1"))
+BATCH_WAIT_MS = float(os.environ.get("MDAI_BATCH_WAIT_MS", "10"))
+
+# Admission control. Limits of 0 disable the corresponding check
+MAX_QUEUED_REQUESTS = int(os.environ.get("MDAI_MAX_QUEUED_REQUESTS", "0"))
+MAX_QUEUED_BYTES = int(os.environ.get("MDAI_MAX_QUEUED_BYTES", "0"))
+QUEUE_HIGH_WATER = int(os.environ.get("MDAI_QUEUE_HIGH_WATER", "0"))
+RETRY_AFTER_SECONDS = os.environ.get("MDAI_RETRY_AFTER_SECONDS", "5")
+
+# File contents larger than this are spooled to an in-memory file while decoding. 0 disables it
+SPOOL_THRESHOLD_BYTES = int(os.environ.get("MDAI_SPOOL_THRESHOLD_BYTES", "0"))
+
+# Streamed responses are written as msgpack lists of up to this many outputs each
+STREAM_CONTENT_TYPE = "application/x-msgpack-stream"
+STREAM_CHUNK_SIZE = int(os.environ.get("MDAI_STREAM_CHUNK_SIZE", "64"))
+
+# Result cache, disabled unless given a memory budget. Outputs are cached for whole requests, or
+# for each file on its own if the model's outputs for a file only depend on that file
+CACHE_BYTES = int(os.environ.get("MDAI_CACHE_BYTES", "0"))
+CACHE_DIR = os.environ.get("MDAI_CACHE_DIR")
+CACHE_DISK_BYTES = int(os.environ.get("MDAI_CACHE_DISK_BYTES", "0"))
+CACHE_PER_FILE = os.environ.get("MDAI_CACHE_PER_FILE", "false").lower() == "true"
+MODEL_VERSION = os.environ.get("MDAI_MODEL_VERSION", "")
+
+# Whether concurrent requests with identical payloads share a single model run
+COALESCE_REQUESTS = os.environ.get("MDAI_COALESCE_REQUESTS", "false").lower() == "true"
+
+# Output validation mode: 'strict', 'sampled' (1 in every interval requests) or 'shadow' (in the
+# background, off the request path)
+VALIDATION_MODE = os.environ.get("MDAI_VALIDATION_MODE", "strict").lower()
+VALIDATION_INTERVAL = int(os.environ.get("MDAI_VALIDATION_INTERVAL", "1"))
+VALIDATION_MAX_PENDING = int(os.environ.get("MDAI_VALIDATION_MAX_PENDING", "16"))
+
+# Server-side DICOM decoding into `data["datasets"]`, on a pool of threads or of processes. A
+# worker count of 0 uses the executor's default
+DECODE_DICOM = os.environ.get("MDAI_DECODE_DICOM", "false").lower() == "true"
+DECODE_WORKERS = int(os.environ.get("MDAI_DECODE_WORKERS", "0")) or None
+DECODE_PROCESSES = os.environ.get("MDAI_DECODE_PROCESSES", "false").lower() == "true"
+
+# Input size of models that downsample images, as rows and columns, to decode DICOM pixel data at
+# a reduced resolution
+DECODE_SIZE = parse_size(os.environ.get("MDAI_DECODE_SIZE", ""))
+
+# Lazily parsed DICOM datasets in `data["datasets"]`, when DICOM files are not decoded up front
+LAZY_DATASETS = os.environ.get("MDAI_LAZY_DATASETS", "false").lower() == "true"
+
+# Whether masks and vertices are checked in full rather than on their first element
+VALIDATION_DEEP = os.environ.get("MDAI_VALIDATION_DEEP", "false").lower() == "true"
+
+# Command of a persistent worker process running the model, instead of importing `MDAIModel`
+WORKER_COMMAND = os.environ.get("MDAI_WORKER_COMMAND", "")
+
+# Structured access log of inference requests
+ACCESS_LOG = os.environ.get("MDAI_ACCESS_LOG", "true").lower() == "true"
+
+# Bearer token of the debug routes, which are disabled when it is not set
+DEBUG_TOKEN = os.environ.get("MDAI_DEBUG_TOKEN", "")
+
+# Requests with bodies of at least this many bytes are followed by a garbage collection and the
+# release of free heap memory to the system (0 to disable)
+RECLAIM_THRESHOLD_BYTES = int(os.environ.get("MDAI_RECLAIM_THRESHOLD_BYTES", "0"))
+
+# Whether allocations are traced with tracemalloc, to report the Python memory held by requests
+TRACE_MEMORY = os.environ.get("MDAI_TRACE_MEMORY", "false").lower() == "true"
+if TRACE_MEMORY:
+    tracemalloc.start()
+
 mdai_model = None
+mdai_models = []
 mdai_model_ready = False
 mdai_model_error = ""
+# Seconds spent in each phase of loading the model: 'import', 'construct' and 'warmup'
+startup_seconds = {}
+
+output_validator = OutputValidator(deep=VALIDATION_DEEP)
+batch_scheduler = None
+admission = AdmissionController(MAX_QUEUED_REQUESTS, MAX_QUEUED_BYTES, QUEUE_HIGH_WATER)
+result_cache = None
+if CACHE_BYTES > 0:
+    result_cache = ResultCache(CACHE_BYTES, CACHE_DIR, CACHE_DISK_BYTES)
+coalescer = SingleFlight()
+profile_capture = None
+reclaiming = False
 
-output_validator = OutputValidator()
+# Each model replica runs on its own dedicated thread so it never blocks the event loop, while
+# decoding, validation and serialization for other requests proceed alongside on compute threads
+model_executor = ThreadPoolExecutor(max_workers=MODEL_REPLICAS, thread_name_prefix="model")
+compute_executor = ThreadPoolExecutor(thread_name_prefix="compute")
+# Request bodies are decoded on threads of their own, as they block while waiting for the client
+# to send more of the body, so that slow uploads never hold up compute threads. There is one for
+# each request that can be admitted, or `BODY_WORKERS` when admission is unlimited, in which case
+# further uploads wait for a thread
+BODY_WORKERS = 32
+body_executor = ThreadPoolExecutor(
+    max_workers=MAX_QUEUED_REQUESTS or BODY_WORKERS, thread_name_prefix="body"
+)
+validation_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="validation")
+decode_executor = None
+if DECODE_DICOM and DECODE_PROCESSES:
+    # Worker processes are spawned rather than forked from a process that is running threads
+    decode_executor = ProcessPoolExecutor(
+        DECODE_WORKERS, mp_context=multiprocessing.get_context("spawn")
+    )
+elif DECODE_DICOM:
+    decode_executor = ThreadPoolExecutor(DECODE_WORKERS, thread_name_prefix="decode")
 
 app = FastAPI()
 
 
+def queued_requests():
+    """Requests waiting for a model replica or a micro-batch."""
+    replicas = getattr(app.state, "replicas", None)
+    queued = len(replicas.waiters) if replicas is not None else 0
+    if batch_scheduler is not None:
+        queued += batch_scheduler.queue.qsize()
+    return queued
+
+
+metrics = MetricsRegistry()
+phase_seconds = metrics.histogram(
+    "mdai_request_phase_seconds",
+    "Seconds spent by inference requests in each phase",
+    SECONDS_BUCKETS,
+    labels=("phase",),
+)
+request_bytes = metrics.histogram(
+    "mdai_request_bytes", "Size of inference request bodies in bytes", BYTES_BUCKETS
+)
+response_bytes = metrics.histogram(
+    "mdai_response_bytes", "Size of inference response bodies in bytes", BYTES_BUCKETS
+)
+request_files = metrics.histogram(
+    "mdai_request_files", "Number of files in each inference request", COUNT_BUCKETS
+)
+request_outputs = metrics.histogram(
+    "mdai_request_outputs", "Number of outputs returned for each inference request", COUNT_BUCKETS
+)
+request_errors = metrics.counter(
+    "mdai_request_errors_total", "Failed inference requests by failed phase", labels=("phase",)
+)
+metrics.gauge(
+    "mdai_requests_in_flight",
+    "Inference requests admitted and not yet answered",
+    lambda: admission.requests,
+)
+metrics.gauge(
+    "mdai_requests_queued", "Inference requests waiting for a model replica", queued_requests
+)
+metrics.gauge(
+    "mdai_model_ready", "Whether the model is loaded and warmed up", lambda: mdai_model_ready
+)
+metrics.gauge(
+    "mdai_startup_seconds",
+    "Seconds spent in each phase of loading the model",
+    lambda: {(phase,): seconds for phase, seconds in startup_seconds.items()},
+    labels=("phase",),
+)
+request_rss_growth = metrics.histogram(
+    "mdai_request_rss_growth_bytes",
+    "Growth of the resident memory of the process over inference requests in bytes",
+    BYTES_BUCKETS,
+)
+request_traced_growth = metrics.histogram(
+    "mdai_request_traced_growth_bytes",
+    "Growth of the memory traced by tracemalloc over inference requests in bytes",
+    BYTES_BUCKETS,
+)
+memory_reclaims = metrics.counter(
+    "mdai_memory_reclaims_total", "Memory reclamations run after large inference requests"
+)
+memory_reclaimed_bytes = metrics.counter(
+    "mdai_memory_reclaimed_bytes_total", "Resident memory released by memory reclamations in bytes"
+)
+memory_reclaim_seconds = metrics.counter(
+    "mdai_memory_reclaim_seconds_total", "Seconds spent reclaiming memory"
+)
+metrics.gauge("mdai_process_rss_bytes", "Resident memory of the process in bytes", current_rss)
+metrics.gauge(
+    "mdai_process_peak_rss_bytes", "Peak resident memory of the process in bytes", peak_rss
+)
+metrics.gauge(
+    "mdai_traced_memory_bytes",
+    "Memory traced by tracemalloc in bytes, 0 when not tracing",
+    lambda: traced_memory()[0],
+)
+
+
+def log_request(stats, status):
+    if ACCESS_LOG:
+        access_logger.info(json.dumps(stats.log_record(status)))
+
+
+def add_request_headers(response, stats):
+    """Add the request ID and the phases timed so far, for responses not yet sent."""
+    response.headers["X-Request-ID"] = stats.request_id
+    response.headers["Server-Timing"] = stats.server_timing()
+    return response
+
+
+def request_scope(data):
+    """Scopes of the labels of a request, e.g. 'SERIES', or None if it has no label classes."""
+    scopes = {
+        label_class.get("label", {}).get("scope") for label_class in data.get("label_classes", [])
+    }
+    scopes.discard(None)
+    return ",".join(sorted(scopes)) or None
+
+
+def record_request(stats, status):
+    log_request(stats, status)
+    if profile_capture is not None:
+        profile_capture.request_done()
+    for phase, seconds in stats.phases.items():
+        phase_seconds.observe(seconds, phase)
+    request_bytes.observe(stats.request_bytes)
+    response_bytes.observe(stats.response_bytes)
+    if stats.files is not None:
+        request_files.observe(stats.files)
+    if stats.outputs is not None:
+        request_outputs.observe(stats.outputs)
+    request_rss_growth.observe(stats.rss_peak - stats.rss_start)
+    if tracemalloc.is_tracing():
+        request_traced_growth.observe(max(stats.traced_peak - stats.traced_start, 0))
+
+
+async def reclaim_after_request(stats):
+    """
+    Reclaim memory after a request with a body of at least `RECLAIM_THRESHOLD_BYTES`, unless a
+    reclamation is already running.
+    """
+    global reclaiming
+    if not RECLAIM_THRESHOLD_BYTES or stats.request_bytes < RECLAIM_THRESHOLD_BYTES or reclaiming:
+        return
+    reclaiming = True
+    try:
+        start = time.perf_counter()
+        released = await asyncio.get_event_loop().run_in_executor(compute_executor, reclaim_memory)
+        memory_reclaims.inc()
+        memory_reclaimed_bytes.inc(amount=released)
+        memory_reclaim_seconds.inc(amount=time.perf_counter() - start)
+    finally:
+        reclaiming = False
+
+
+async def run_in_executor(executor, func, *args):
+    """
+    Run a blocking call on the given executor without blocking the event loop, under the profile
+    being captured if any.
+    """
+    if profile_capture is not None:
+        return await asyncio.get_event_loop().run_in_executor(
+            executor, profile_capture.run, func, *args
+        )
+    return await asyncio.get_event_loop().run_in_executor(executor, func, *args)
+
+
+def predict(model, data, stream=False):
+    """Run the model, collecting outputs returned as an iterator unless they will be streamed."""
+    results = model.predict(data)
+    if isinstance(results, Iterator) and not stream:
+        results = list(results)
+    return results
+
+
+def run_batch(model, batch):
+    """
+    Run a list of INSTANCE scope inputs, preferring the model's optional batch hook. Otherwise each
+    input is run on its own, and the exception of an input that fails is returned in place of its
+    results, so that it only fails the request it came from.
+    """
+    if hasattr(model, "predict_batch"):
+        return model.predict_batch(batch)
+    results_list = []
+    for data in batch:
+        try:
+            results_list.append(predict(model, data))
+        except Exception as e:
+            results_list.append(e)
+    return results_list
+
+
+def run_timed_batch(model, batch):
+    """`run_batch` for the batch scheduler, returning each result with the batch's run time."""
+    start = time.perf_counter()
+    if profile_capture is not None:
+        results_list = profile_capture.run(run_batch, model, batch)
+    else:
+        results_list = run_batch(model, batch)
+    seconds = time.perf_counter() - start
+    return [
+        results if isinstance(results, Exception) else (results, seconds)
+        for results in results_list
+    ]
+
+
+def pack(results):
+    return msgpack.packb(results, use_bin_type=True, default=encode_numpy)
+
+
+def decode_dicom(files):
+    """Decode DICOM files in parallel, see `dicom.decode_datasets`."""
+    return decode_datasets(files, decode_executor, DECODE_PROCESSES, DECODE_SIZE)
+
+
+async def attach_datasets(items):
+    """Add the `datasets` of each request data in `items`, decoded or lazy as configured."""
+    files = [file for data in items for file in data["files"]]
+    decoded = None
+    if DECODE_DICOM:
+        decoded = await run_in_executor(compute_executor, decode_dicom, files)
+    set_datasets(items, files, decoded)
+
+
+def set_datasets(items, files, decoded=None):
+    """
+    Add the `datasets` of each request data in `items` from their `files`, as decoded by
+    `decode_dicom`, or lazy when `decoded` is None.
+    """
+    pixel_arrays = None
+    if decoded is not None:
+        datasets = [entry[0] if entry is not None else None for entry in decoded]
+        if DECODE_SIZE is not None:
+            pixel_arrays = [entry[1] if entry is not None else None for entry in decoded]
+    else:
+        datasets = lazy_datasets(files)
+    start = 0
+    for data in items:
+        end = start + len(data["files"])
+        data["datasets"] = datasets[start:end]
+        if pixel_arrays is not None:
+            data["pixel_arrays"] = pixel_arrays[start:end]
+        start = end
+
+
+def validate_all(results_list):
+    for results in results_list:
+        output_validator.validate(results)
+
+
+validation_policy = ValidationPolicy(
+    validate_all,
+    VALIDATION_MODE,
+    VALIDATION_INTERVAL,
+    VALIDATION_MAX_PENDING,
+    executor=compute_executor,
+    shadow_executor=validation_executor,
+)
+
+
+def cache_results(keys, results_list):
+    entries = [pack_entry(results, default=encode_numpy) for results in results_list]
+    for key, entry in zip(keys, entries):
+        result_cache.put(key, entry)
+    return entries
+
+
+def request_keys(data, per_file):
+    """Digests of the request payload, one per file if `per_file`, else one for the request."""
+    if per_file:
+        return file_keys(MODEL_VERSION, data)
+    return [request_key(MODEL_VERSION, data)]
+
+
+def lookup(keys):
+    return [result_cache.get(key) for key in keys]
+
+
+class InferenceJob:
+    """
+    An inference request once its payload has been decoded. The input data is handed over to
+    whichever coroutine runs the job, so that it can be released as soon as the model is done.
+    """
+
+    def __init__(
+        self, data, deadline, stats, stream=False, keys=None, use_cache=False, per_file=False
+    ):
+        self.data = data
+        self.deadline = deadline
+        self.stats = stats
+        self.stream = stream
+        self.keys = keys
+        self.use_cache = use_cache
+        self.per_file = per_file
+
+    def take_data(self):
+        data, self.data = self.data, None
+        return data
+
+
+class OutputStream:
+    """
+    Validates and packs outputs from the model's iterator one chunk at a time. Takes over the model
+    replica checked out for the request, releasing it once the iterator is exhausted, fails or is
+    closed.
+    """
+
+    def __init__(self, outputs, replica, stats):
+        self.outputs = outputs
+        self.replica = replica
+        self.stats = stats
+        self.closing = None
+        self.validate = validation_policy.sample()
+        # Held while the iterator runs on a model thread, which must finish before it is closed
+        self.lock = threading.Lock()
+
+    def next_chunk(self):
+        with self.lock:
+            return list(islice(self.outputs, STREAM_CHUNK_SIZE))
+
+    async def __aiter__(self):
+        stats = self.stats
+        count = 0
+        try:
+            while True:
+                try:
+                    with stats.time("predict"):
+                        chunk = await run_in_executor(model_executor, self.next_chunk)
+                except Exception as e:
+                    logger.exception(e)
+                    request_errors.inc("model")
+                    error = f"Error running model: {traceback.format_exc()}"
+                    break
+                if not chunk:
+                    error = None
+                    break
+                try:
+                    if self.validate:
+                        with stats.time("validate"):
+                            await validation_policy.validate([chunk])
+                    with stats.time("pack"):
+                        packed = await run_in_executor(compute_executor, pack, chunk)
+                except Exception as e:
+                    logger.exception(e)
+                    request_errors.inc("validate")
+                    error = f"Invalid data format returned by model: {e}"
+                    break
+                stats.response_bytes += len(packed)
+                yield packed
+                count += len(chunk)
+        finally:
+            await self.close()
+
+        stats.outputs = count
+        if error is None:
+            packed = pack({"status": "ok", "count": count})
+        else:
+            packed = pack({"status": "error", "count": count, "error": error})
+        stats.response_bytes += len(packed)
+        yield packed
+
+    def close_outputs(self):
+        with self.lock:
+            self.outputs.close()
+
+    async def close(self):
+        """
+        Close the iterator and release the replica. This runs to completion even if the caller is
+        cancelled, such as when the client disconnects.
+        """
+        if self.closing is None:
+            self.closing = asyncio.ensure_future(self.release())
+        await asyncio.shield(self.closing)
+
+    async def release(self):
+        try:
+            if hasattr(self.outputs, "close"):
+                await run_in_executor(model_executor, self.close_outputs)
+        except Exception as e:
+            logger.exception(e)
+        finally:
+            app.state.replicas.release(self.replica)
+
+
+async def finish_stream(response, size, stats):
+    # Releases the model if the client disconnected before the stream was exhausted
+    await response.body_iterator.close()
+    admission.release(size)
+    record_request(stats, response.status_code)
+    await reclaim_after_request(stats)
+
+
+def _error_response(content: str, phase: str, status_code=500, headers=None):
+    """Error response for a request that failed in `phase`, which is counted in the metrics."""
+    request_errors.inc(phase)
+    headers = {"Content-Type": "text/plain", **(headers or {})}
+    return Response(content, status_code=status_code, headers=headers)
+
+
+def _unavailable_response(content: str, phase: str, status_code=503):
+    return _error_response(content, phase, status_code, {"Retry-After": RETRY_AFTER_SECONDS})
+
+
+def _cached_response(entries, status):
+    headers = {"Content-Type": "application/msgpack", "X-Cache": status}
+    return Response(content=join_entries(entries), status_code=200, headers=headers)
+
+
 @app.post("/inference")
 async def inference(request: Request):
     """
@@ -98,6 +639,26 @@ async def inference(request: Request):
     representing a DICOM file, and can be loaded using:
     `ds = pydicom.dcmread(BytesIO(file["content"]))`.
 
+    When `MDAI_DECODE_DICOM` is set, DICOM files are parsed and their pixel data decoded by the
+    server, in parallel, and `data` has an additional key:
+
+    "datasets": [pydicom.Dataset or None, ...]
+
+    with the dataset of each file in `files`, in order, or None for files that are not DICOM.
+    Pixel data is already decoded, so `ds.pixel_array` returns immediately. If `MDAI_DECODE_SIZE`
+    is also set, pixel data is instead decoded at a reduced resolution, no smaller than that size,
+    with `dicom.decode_reduced`, and given in an additional key:
+
+    "pixel_arrays": [numpy.ndarray or None, ...]
+
+    Otherwise, when `MDAI_LAZY_DATASETS` is set, `datasets` holds `dicom.LazyDataset` views that
+    only parse a file's header when one of its tags is first accessed, and its pixel data when
+    `pixel_array` is, so that models can select files by their tags without decoding all of them.
+
+    `content` values larger than 1 MiB are `bytearray` objects rather than `bytes`. When
+    `MDAI_SPOOL_THRESHOLD_BYTES` is set, `content` values larger than the threshold are read-only
+    `mmap` objects. All support the buffer protocol.
+
     The response body should be the msgpack-serialized binary data of the results:
 
     [
@@ -125,45 +686,331 @@ async def inference(request: Request):
     ]
 
     The DICOM UIDs must be supplied based on the scope of the label attached to `class_index`.
+
+    Numeric values may be numpy scalars, and `probability`, `data["vertices"]` and `data["mask"]`
+    may be numpy arrays. Arrays are serialized without conversion to lists, as a map of `dtype`
+    (a numpy dtype string such as '<f4'), `shape` (list of ints) and `data` (raw C-order bytes),
+    which `np.frombuffer(data, dtype=dtype).reshape(shape)` turns back into an array.
+
+    When `MDAI_MAX_BATCH_SIZE` is greater than 1, concurrent single-file requests are grouped and
+    passed to `MDAIModel.predict_batch(list_of_data)` if the model defines it, which must return
+    one list of outputs per input `data`, in order.
+
+    Requests may set an `X-Request-Timeout` header in seconds. Requests still waiting for the model
+    when it expires are dropped with a 503 response. Requests beyond the admission limits are
+    rejected immediately with a 429 response. Both carry a `Retry-After` header.
+
+    Models producing many outputs may return an iterator of outputs from `predict` instead of a
+    list. If the request's `Accept` header includes `application/x-msgpack-stream`, outputs are
+    then validated and sent as they are produced. The streamed body is a sequence of msgpack
+    objects: lists of up to `MDAI_STREAM_CHUNK_SIZE` outputs, whose concatenation is the full list
+    of results, followed by a single terminating map:
+
+    {
+        "status": "str", # 'ok', 'error'
+        "count": "int", # Number of outputs sent
+        "error": "str", # Error message, if status is 'error'
+    }
+
+    A stream that ends without the terminating map was interrupted. Otherwise, and for requests
+    that do not accept a stream, iterators are collected into a list before validation.
+
+    When the result cache is enabled with `MDAI_CACHE_BYTES`, responses carry an `X-Cache` header
+    with 'HIT', 'PARTIAL' or 'MISS'. Requests with a `Cache-Control: no-cache` header bypass it.
+    With `MDAI_CACHE_PER_FILE`, outputs are cached per file and only files that miss the cache are
+    run, each as a request with a single file, through `MDAIModel.predict_batch` if defined.
+
+    Outputs are validated before the response is sent unless `MDAI_VALIDATION_MODE` is 'sampled',
+    where only some responses are validated, or 'shadow', where validation runs in the background
+    and failures are only logged and counted.
+
+    With `MDAI_COALESCE_REQUESTS`, requests arriving while an identical request is in flight wait for
+    and receive its response instead of running the model again. Streamed requests are not
+    coalesced.
     """
     if not request.headers["content-type"] == "application/msgpack":
         raise HTTPException(status_code=400)
 
-    def _error_response(content: str):
-        headers = {"Content-Type": "text/plain"}
-        return Response(content, status_code=500, headers=headers)
-
-    if not mdai_model:
+    stats = RequestStats(request.headers.get("x-request-id"))
+    if not mdai_model_ready and not mdai_model_error:
+        response = _unavailable_response("Model is loading", "init")
+        log_request(stats, response.status_code)
+        return add_request_headers(response, stats)
+    if not mdai_model_ready:
         logger.exception(mdai_model_error)
-        return _error_response(f"Error initializing model: {mdai_model_error}")
+        response = _error_response(f"Error initializing model: {mdai_model_error}", "init")
+        log_request(stats, response.status_code)
+        return add_request_headers(response, stats)
+
+    try:
+        deadline = get_deadline(request.headers)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    size = int(request.headers.get("content-length", 0))
+    if not admission.admit(size):
+        response = _unavailable_response("Server is busy", "admission", status_code=429)
+        log_request(stats, response.status_code)
+        return add_request_headers(response, stats)
+    try:
+        response = await run_inference(request, deadline, stats, size)
+    except BaseException:
+        admission.release(max(size, stats.request_bytes))
+        raise
+    # Bodies larger than their Content-Length, such as chunked uploads, were charged as read
+    size = max(size, stats.request_bytes)
+    if isinstance(response, StreamingResponse):
+        # Streamed requests stay admitted until the last output has been sent, and are only
+        # recorded then. Their headers only hold the phases before the first output
+        response.background = BackgroundTask(finish_stream, response, size, stats)
+    else:
+        admission.release(size)
+        stats.response_bytes = len(response.body)
+        record_request(stats, response.status_code)
+        response.background = BackgroundTask(reclaim_after_request, stats)
+    return add_request_headers(response, stats)
+
 
-    async with app.state.lock:
+async def run_inference(request: Request, deadline, stats, size):
+    charged = size
+
+    def charge(bytes_read):
+        # Bytes beyond the admitted `size` are charged to admission as they arrive
+        nonlocal charged
+        if bytes_read > charged:
+            extra, charged = bytes_read - charged, bytes_read
+            admission.charge(extra)
+
+    # Decoding starts as soon as the first chunks arrive, one file content at a time
+    reader = AsyncStreamReader(request.stream(), asyncio.get_event_loop(), charge)
+    start = time.perf_counter()
+    try:
+        data = await run_in_executor(
+            body_executor, decode_request_stream, reader, SPOOL_THRESHOLD_BYTES
+        )
+    except AdmissionRejected:
+        return _unavailable_response("Server is busy", "admission", status_code=429)
+    except Exception as e:
+        logger.exception(e)
+        return _error_response("Error reading input data", "read")
+    finally:
+        # Time spent waiting for the body to arrive is reading, the rest is unpacking
+        stats.add("read", reader.wait_seconds)
+        stats.add("unpack", time.perf_counter() - start - reader.wait_seconds)
+        stats.request_bytes = reader.bytes_read
+    del reader
+    stats.files = len(data.get("files", []))
+    stats.scope = request_scope(data)
+
+    stream = STREAM_CONTENT_TYPE in request.headers.get("accept", "")
+    use_cache = result_cache is not None and "no-cache" not in request.headers.get(
+        "cache-control", ""
+    )
+    per_file = use_cache and CACHE_PER_FILE
+    coalesce = COALESCE_REQUESTS and not stream
+
+    keys = None
+    if use_cache or coalesce:
         try:
-            body = await request.body()
-            data = msgpack.unpackb(body, raw=False)
+            with stats.time("cache"):
+                keys = await run_in_executor(compute_executor, request_keys, data, per_file)
         except Exception as e:
             logger.exception(e)
-            return _error_response("Error reading input data")
+            return _error_response("Error reading input data", "cache")
+
+    if not coalesce:
+        job = InferenceJob(data, deadline, stats, stream, keys, use_cache, per_file)
+        del data
+        return await run_job(job)
 
+    # The shared job runs without the deadline of the request that started it, as each request
+    # waiting for it applies its own
+    job = InferenceJob(data, None, stats, stream, keys, use_cache, per_file)
+    del data
+    try:
+        fingerprint = (use_cache, per_file) + tuple(keys)
+        status_code, content, headers = await coalescer.run(
+            fingerprint, lambda: run_shared_job(job), time_remaining(deadline)
+        )
+    except asyncio.TimeoutError:
+        logger.warning("Request deadline exceeded before inference completed")
+        return _unavailable_response("Request deadline exceeded", "timeout")
+    # Each request gets its own response to add its headers and background task to
+    return Response(content=content, status_code=status_code, headers=headers)
+
+
+async def run_shared_job(job: InferenceJob):
+    """Run a coalesced job, returning the status, body and headers of its response."""
+    response = await run_job(job)
+    return response.status_code, response.body, dict(response.headers)
+
+
+def count_outputs(results_list):
+    """Number of outputs in a list of results, or None if a result is not a list."""
+    if not all(isinstance(results, list) for results in results_list):
+        return None
+    return sum(len(results) for results in results_list)
+
+
+async def check_outputs(results_list, stats):
+    """Validate outputs as set by the validation policy, timing foreground validation."""
+    start = time.perf_counter()
+    if await validation_policy.check(results_list):
+        stats.add("validate", time.perf_counter() - start)
+
+
+async def run_job(job: InferenceJob):
+    if job.use_cache and job.per_file:
+        return await run_job_per_file(job)
+
+    data = job.take_data()
+    deadline = job.deadline
+    stats = job.stats
+    if job.use_cache:
         try:
-            results = mdai_model.predict(data)
+            with stats.time("cache"):
+                [entry] = await run_in_executor(compute_executor, lookup, job.keys)
         except Exception as e:
             logger.exception(e)
-            return _error_response(f"Error running model: {traceback.format_exc()}")
+            return _error_response("Error reading input data", "cache")
+        if entry is not None:
+            return _cached_response([entry], "HIT")
 
+    if DECODE_DICOM or LAZY_DATASETS:
         try:
-            output_validator.validate(results)
+            with stats.time("decode"):
+                await attach_datasets([data])
         except Exception as e:
             logger.exception(e)
-            return _error_response(f"Invalid data format returned by model: {e}")
+            return _error_response("Error reading input data", "decode")
 
+    try:
+        start = time.perf_counter()
+        if batch_scheduler is not None and len(data.get("files", [])) == 1:
+            results, seconds = await asyncio.wait_for(
+                batch_scheduler.submit(data), time_remaining(deadline)
+            )
+            stats.add("queue", time.perf_counter() - start - seconds)
+            stats.add("predict", seconds)
+        else:
+            replica = await app.state.replicas.acquire(time_remaining(deadline))
+            stats.add("queue", time.perf_counter() - start)
+            results = None
+            try:
+                with stats.time("predict"):
+                    results = await run_in_executor(
+                        model_executor, predict, replica.model, data, job.stream
+                    )
+            finally:
+                # The replica is held until a streamed response has been fully produced
+                if not isinstance(results, Iterator):
+                    app.state.replicas.release(replica)
+    except asyncio.TimeoutError:
+        logger.warning("Request deadline exceeded before inference completed")
+        return _unavailable_response("Request deadline exceeded", "timeout")
+    except Exception as e:
+        logger.exception(e)
+        return _error_response(f"Error running model: {traceback.format_exc()}", "model")
+    del data
+
+    if isinstance(results, Iterator):
+        return StreamingResponse(
+            OutputStream(results, replica, stats), media_type=STREAM_CONTENT_TYPE
+        )
+    stats.outputs = count_outputs([results])
+
+    try:
+        await check_outputs([results], stats)
+    except Exception as e:
+        logger.exception(e)
+        return _error_response(f"Invalid data format returned by model: {e}", "validate")
+
+    try:
+        with stats.time("pack"):
+            if job.use_cache:
+                entries = await run_in_executor(
+                    compute_executor, cache_results, job.keys, [results]
+                )
+                return _cached_response(entries, "MISS")
+            resp_content = await run_in_executor(compute_executor, pack, results)
+        del results
+        headers = {"Content-Type": "application/msgpack"}
+        return Response(content=resp_content, status_code=200, headers=headers)
+    except Exception as e:
+        logger.exception(e)
+        return _error_response("Error writing output data", "write")
+
+
+async def run_job_per_file(job: InferenceJob):
+    data = job.take_data()
+    deadline = job.deadline
+    stats = job.stats
+    keys = job.keys
+    try:
+        with stats.time("cache"):
+            entries = await run_in_executor(compute_executor, lookup, keys)
+    except Exception as e:
+        logger.exception(e)
+        return _error_response("Error reading input data", "cache")
+
+    misses = [index for index, entry in enumerate(entries) if entry is None]
+    if not misses:
+        return _cached_response(entries, "HIT")
+
+    batch = [dict(data, files=[data["files"][index]]) for index in misses]
+    del data
+    if DECODE_DICOM or LAZY_DATASETS:
         try:
-            resp_content = msgpack.packb(results, use_bin_type=True)
-            headers = {"Content-Type": "application/msgpack"}
-            return Response(content=resp_content, status_code=200, headers=headers)
+            with stats.time("decode"):
+                await attach_datasets(batch)
         except Exception as e:
             logger.exception(e)
-            return _error_response("Error writing output data")
+            return _error_response("Error reading input data", "decode")
+    try:
+        with stats.time("queue"):
+            replica = await app.state.replicas.acquire(time_remaining(deadline))
+        try:
+            with stats.time("predict"):
+                results_list = await run_in_executor(
+                    model_executor, run_batch, replica.model, batch
+                )
+        finally:
+            app.state.replicas.release(replica)
+        if len(results_list) != len(batch):
+            raise ValueError(
+                "Expected {} batch results, got {}".format(len(batch), len(results_list))
+            )
+        for results in results_list:
+            if isinstance(results, Exception):
+                raise results
+    except asyncio.TimeoutError:
+        logger.warning("Request deadline exceeded before inference completed")
+        return _unavailable_response("Request deadline exceeded", "timeout")
+    except Exception as e:
+        logger.exception(e)
+        return _error_response(f"Error running model: {traceback.format_exc()}", "model")
+    del batch
+    stats.outputs = count_outputs(results_list)
+
+    try:
+        await check_outputs(results_list, stats)
+    except Exception as e:
+        logger.exception(e)
+        return _error_response(f"Invalid data format returned by model: {e}", "validate")
+
+    try:
+        miss_keys = [keys[index] for index in misses]
+        with stats.time("pack"):
+            miss_entries = await run_in_executor(
+                compute_executor, cache_results, miss_keys, results_list
+            )
+        del results_list
+        for index, entry in zip(misses, miss_entries):
+            entries[index] = entry
+        return _cached_response(entries, "MISS" if len(misses) == len(entries) else "PARTIAL")
+    except Exception as e:
+        logger.exception(e)
+        return _error_response("Error writing output data", "write")
 
 
 @app.get("/healthz")
@@ -174,36 +1021,224 @@ def healthz():
 
 @app.get("/ready")
 def ready():
-    """Route for Kubernetes readiness check."""
-    if mdai_model_ready:
+    """
+    Route for Kubernetes readiness check. Reports not ready until the model is loaded and warmed
+    up, if it failed to load, and while the inference queue is above its high-water mark so that
+    traffic is routed to other replicas.
+    """
+    if mdai_model_ready and not admission.busy():
         return Response(status_code=200, content="")
     else:
         return Response(status_code=503, content="")
 
 
+@app.get("/startup")
+def startup():
+    """Route for retrieving the model loading status and the seconds spent in each phase."""
+    if mdai_model_ready:
+        status = "ready"
+    elif mdai_model_error:
+        status = "failed"
+    else:
+        status = "loading"
+    return {"status": status, "seconds": startup_seconds}
+
+
+@app.get("/replicas")
+def replicas():
+    """Route for retrieving usage statistics of the model replicas in this server process."""
+    return app.state.replicas.utilization()
+
+
+@app.get("/cache")
+def cache():
+    """Route for retrieving result cache and request coalescing statistics of this server process."""
+    stats = {"coalesced": coalescer.coalesced}
+    if result_cache is not None:
+        stats.update(result_cache.stats())
+    return stats
+
+
+@app.get("/validation")
+def validation():
+    """Route for retrieving output validation statistics of this server process."""
+    return validation_policy.stats()
+
+
+@app.get("/metrics")
+def metrics_route():
+    """Route for Prometheus metrics of this server process, in the text exposition format."""
+    return Response(content=metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+@app.post("/debug/profile")
+async def debug_profile(
+    request: Request, mode: str = CPROFILE, requests: int = 0, seconds: float = 0, top: int = 50
+):
+    """
+    Route for profiling this server process over the next `requests` inference requests, or for
+    `seconds`, see `profiling.ProfileCapture` for the modes. Responds with the report as text
+    once the capture is done. Needs an `Authorization: Bearer <MDAI_DEBUG_TOKEN>` header.
+    """
+    global profile_capture
+
+    if not DEBUG_TOKEN:
+        raise HTTPException(status_code=404)
+    authorization = request.headers.get("authorization", "").encode()
+    if not hmac.compare_digest(authorization, f"Bearer {DEBUG_TOKEN}".encode()):
+        raise HTTPException(status_code=401)
+    if profile_capture is not None:
+        raise HTTPException(status_code=409, detail="A profile is already being captured")
+    try:
+        capture = ProfileCapture(mode, requests, seconds, top)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    capture.start()
+    profile_capture = capture
+    try:
+        await capture.wait()
+    finally:
+        profile_capture = None
+    report = await run_in_executor(compute_executor, capture.report)
+    return Response(content=report, media_type="text/plain")
+
+
 @app.get("/version")
 def version():
     """Route for retrieving server version."""
     return Response(status_code=200, content=MDAI_DEPLOY_API_VERSION)
 
 
-if __name__ == "__main__":
+@contextmanager
+def startup_phase(phase):
+    start = time.perf_counter()
     try:
-        from mdai_deploy import MDAIModel
+        yield
+    finally:
+        startup_seconds[phase] = time.perf_counter() - start
+
+
+def warmup_data():
+    """Request data of the sample request at `WARMUP_PATH`, decoded as for a real request."""
+    with open(WARMUP_PATH, "rb") as f:
+        data = decode_request_stream(f)
+    files = data.get("files", [])
+    if DECODE_DICOM:
+        # Decoded on a pool of its own, to not start processes in a server about to be forked
+        with ThreadPoolExecutor(thread_name_prefix="warmup") as executor:
+            set_datasets([data], files, decode_datasets(files, executor, size=DECODE_SIZE))
+    elif LAZY_DATASETS:
+        set_datasets([data], files)
+    return data
+
 
-        mdai_model = MDAIModel()
+def warm_up(models):
+    """
+    Run the `warmup` hook of each model instance, or else predict on the sample request at
+    `WARMUP_PATH` if there is one, so that the first requests do not pay for lazy initialization.
+    """
+    has_sample = os.path.isfile(WARMUP_PATH)
+    for model in {id(model): model for model in models}.values():
+        if hasattr(model, "warmup"):
+            model.warmup()
+        elif has_sample:
+            predict(model, warmup_data())
+
+
+def load_model():
+    """
+    Import, construct and warm up the model replicas, timing each phase. Errors are kept in
+    `mdai_model_error` to be reported by inference requests.
+    """
+    global mdai_model, mdai_models, mdai_model_error
+
+    try:
+        if WORKER_COMMAND:
+            # Each replica runs on its own worker process, which warms up its model itself
+            with startup_phase("construct"):
+                models = [WorkerModel(WORKER_COMMAND, cwd=MDAI_PATH) for _ in range(MODEL_REPLICAS)]
+        else:
+            with startup_phase("import"):
+                from mdai_deploy import MDAIModel
+
+            with startup_phase("construct"):
+                models = [MDAIModel()]
+                for _ in range(MODEL_REPLICAS - 1):
+                    thread_safe = getattr(models[0], "thread_safe", False)
+                    models.append(models[0] if thread_safe else MDAIModel())
+        with startup_phase("warmup"):
+            warm_up(models)
     except Exception:
         mdai_model_error = traceback.format_exc()
+        logger.error(f"Error initializing model: {mdai_model_error}")
+        return
+    mdai_models = models
+    mdai_model = models[0]
+
+
+def start_model():
+    """Start serving inference requests on the loaded model replicas, if loading succeeded."""
+    global batch_scheduler, mdai_model_ready
+
+    if mdai_model is None:
+        return
+
+    # Ensure each model replica runs one inference at a time
+    app.state.replicas = ReplicaPool(mdai_models)
 
+    if MAX_BATCH_SIZE > 1:
+        batch_scheduler = BatchScheduler(
+            run_timed_batch,
+            app.state.replicas,
+            max_batch_size=MAX_BATCH_SIZE,
+            max_wait_ms=BATCH_WAIT_MS,
+            executor=model_executor,
+        )
+        batch_scheduler.start()
     mdai_model_ready = True
 
+
+async def load_model_in_background():
+    # Loaded on a model thread, for frameworks that keep per-thread state
+    await asyncio.get_event_loop().run_in_executor(model_executor, load_model)
+    start_model()
+
+
+def serve(config, sockets=None, background_load=False):
+    """
+    Run the server on a new event loop in the current process. With `background_load`, the model is
+    loaded in the background while the server already answers liveness checks.
+    """
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
 
-    # Ensure inference is run one at a time
-    app.state.lock = asyncio.Lock()
+    app.state.replicas = ReplicaPool([])
+    if background_load:
+        loop.create_task(load_model_in_background())
+    else:
+        start_model()
 
-    config = Config(app=app, host="0.0.0.0", port=6324, workers=1)
     server = Server(config)
 
-    loop.run_until_complete(server.serve())
+    loop.run_until_complete(server.serve(sockets=sockets))
+
+
+if __name__ == "__main__":
+    config = Config(app=app, host="0.0.0.0", port=6324, workers=1)
+
+    if WORKERS > 1:
+        # Workers share the memory of the model loaded in the parent process, so it is loaded
+        # before they are forked. Models running in worker processes share nothing, so each server
+        # process starts and warms up its own before it is ready. Workers accept connections on
+        # the same socket. Freezing the objects created so far keeps the garbage collector from
+        # touching, and so copying, the shared model memory
+        preload = not WORKER_COMMAND
+        if preload:
+            load_model()
+        sock = config.bind_socket()
+        gc.collect()
+        gc.freeze()
+        run_workers(WORKERS, lambda: serve(config, sockets=[sock], background_load=not preload))
+    else:
+        serve(config, background_load=True)
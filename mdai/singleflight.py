@@ -0,0 +1,29 @@
+import asyncio
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into a single call.
+
+    The first caller for a key starts the call. Callers arriving with the same key while it is in
+    flight wait for, and share, its result. The shared call is not cancelled when any one of its
+    callers is, so it keeps running for the others.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.coalesced = 0
+
+    async def run(self, key, func, timeout=None):
+        """
+        Await `func()`, or the call already in flight for `key`. Raises `asyncio.TimeoutError` if
+        the result is not available within `timeout` seconds.
+        """
+        call = self.calls.get(key)
+        if call is None:
+            call = asyncio.ensure_future(func())
+            self.calls[key] = call
+            call.add_done_callback(lambda _: self.calls.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.wait_for(asyncio.shield(call), timeout)
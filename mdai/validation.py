@@ -1,9 +1,33 @@
+import numpy as np
+
+# Python types that numpy scalars of each dtype kind are validated as
+NUMPY_SCALAR_TYPES = {"b": bool, "i": int, "u": int, "f": float, "U": str}
+
+
 class InvalidFormatException(Exception):
     pass
 
 
+def value_type(value):
+    """Type of `value` for validation, numpy scalars standing in for Python numbers."""
+    if isinstance(value, np.generic):
+        return NUMPY_SCALAR_TYPES.get(value.dtype.kind, type(value))
+    return type(value)
+
+
 class OutputValidator:
-    def __init__(self):
+    """
+    Validates the outputs returned by a model.
+
+    Masks and vertices given as lists are only checked on their first element, unless
+    `deep` is set, in which case they are converted to numpy arrays and checked in full:
+    rows of equal length, numeric values, no NaN or infinite values, and no negative
+    mask values.
+    """
+
+    def __init__(self, deep=False):
+        self.deep = deep
+
         self.required_keys = {
             "NONE": ["study_uid"],
             "ANNOTATION": ["study_uid", "class_index"],
@@ -22,7 +46,7 @@ class OutputValidator:
             "frame_number": [int, type(None)],
             "class_index": int,
             "data": [dict, type(None)],
-            "probability": [float, list, type(None)],
+            "probability": [float, list, np.ndarray, type(None)],
             "explanations": [list, type(None)],
             "note": [str, dict, type(None)],
             "images": [list, type(None)],
@@ -32,8 +56,8 @@ class OutputValidator:
         self.data_types = {
             "point": {"x": int, "y": int},
             "box": {"x": int, "y": int, "width": int, "height": int},
-            "vertices": {"vertices": list},
-            "mask": {"mask": list},
+            "vertices": {"vertices": (list, np.ndarray)},
+            "mask": {"mask": (list, dict, np.ndarray)},
             "video_series_interval": {
                 "start_frame_number": int,
                 "end_frame_number": int,
@@ -50,6 +74,20 @@ class OutputValidator:
             "video_series_interval": None,
         }
 
+        # Masks may also be a dict of compact binary data, see masks.encode_mask
+        self.encoded_mask_types = {
+            "encoding": str,
+            "shape": list,
+            "dtype": str,
+            "data": bytes,
+        }
+        self.mask_encodings = ["bitpack", "rle"]
+
+        # dtype kinds allowed for values given as numpy arrays
+        self.vertex_dtype_kinds = "iuf"
+        self.mask_dtype_kinds = "biuf"
+        self.probability_dtype_kinds = "iuf"
+
         self.note_dict_types = {"input": str, "output": str}
 
         self.image_output_tags_types = {
@@ -58,90 +96,144 @@ class OutputValidator:
             "SeriesInstanceUID": str,
         }
 
+        self.compile()
+
+    def compile(self):
+        """
+        Precompute lookup tables and a check function per output type from the rules
+        above, so that validating an output does no setup of its own. Call again after
+        changing the rules.
+        """
+        self.expected_types = {
+            key: frozenset(types if isinstance(types, list) else [types])
+            for key, types in self.types.items()
+        }
+        self.data_formats = {
+            frozenset(keys): data_format
+            for data_format, keys in self.data_types.items()
+        }
+        self.output_checks = {
+            output_type: self.compile_output_check(required_keys)
+            for output_type, required_keys in self.required_keys.items()
+        }
+
+    def compile_output_check(self, required_keys):
+        required_keys = tuple(required_keys)
+        expected_types = self.expected_types
+        validate_data = self.validate_data
+        validate_note = self.validate_note
+        validate_image_output_tags = self.validate_image_output_tags
+        validate_probability = self.validate_probability
+
+        def check(output):
+            for key in required_keys:
+                if key not in output:
+                    raise InvalidFormatException(
+                        "Key '{}' not found in model output".format(key)
+                    )
+
+            for key, value in output.items():
+                allowed = expected_types.get(key)
+                if allowed is None:
+                    raise InvalidFormatException(
+                        "Unknown key {} in model output".format(key)
+                    )
+                if type(value) not in allowed and value_type(value) not in allowed:
+                    raise InvalidFormatException(
+                        "Incorrect type for key {} in model output. Expected {}, got {}".format(
+                            key, self.types[key], value
+                        )
+                    )
+
+            if isinstance(output.get("probability"), np.ndarray):
+                validate_probability(output["probability"])
+            if output.get("data") is not None:
+                validate_data(output)
+            if output.get("note"):
+                validate_note(output)
+            if output.get("image_output_tags"):
+                validate_image_output_tags(output)
+
+        return check
+
     def validate(self, outputs):
         if not isinstance(outputs, list):
             raise InvalidFormatException("Expected list, got {}".format(type(outputs)))
+        output_checks = self.output_checks
         for output in outputs:
-            self.validate_keys(output)
-            self.validate_types(output)
-            self.validate_data(output)
-            self.validate_note(output)
-            self.validate_image_output_tags(output)
-
-    def validate_keys(self, output):
-        if output.get("type") not in self.required_keys.keys():
-            raise InvalidFormatException(
-                "Invalid output type. Got {}".format(output.get("type"))
-            )
-        for key in self.required_keys[output["type"]]:
-            if key not in output:
-                raise InvalidFormatException(
-                    "Key '{}' not found in model output".format(key)
-                )
-
-    def validate_types(self, output):
-        for key in output.keys():
-            expected_types = (
-                self.types[key]
-                if isinstance(self.types[key], list)
-                else [self.types[key]]
-            )
-            if type(output.get(key)) not in expected_types:
+            check = output_checks.get(output.get("type"))
+            if check is None:
                 raise InvalidFormatException(
-                    "Incorrect type for key {} in model output. Expected {}, got {}".format(
-                        key, self.types[key], output.get(key)
-                    )
+                    "Invalid output type. Got {}".format(output.get("type"))
                 )
+            check(output)
 
     def validate_data(self, output):
-        if output.get("data") is None:
+        data = output.get("data")
+        if data is None:
             return
-        data_format = None
-        for data_type in self.data_types.keys():
-            if set(output["data"].keys()) == set(self.data_types[data_type].keys()):
-                data_format = data_type
 
+        data_format = self.data_formats.get(frozenset(data))
         if data_format is None:
             raise InvalidFormatException(
                 "Model output data field does not conform to any known format."
             )
 
-        for key in output["data"].keys():
-            if not isinstance(output["data"][key], self.data_types[data_format][key]):
+        data_types = self.data_types[data_format]
+        for key, value in data.items():
+            expected_type = data_types[key]
+            if not isinstance(value, expected_type) and not issubclass(
+                value_type(value), expected_type
+            ):
                 raise InvalidFormatException(
                     "Invalid type for key '{}' in data. Expected {}, got {}".format(
-                        key,
-                        self.data_types[data_format][key],
-                        type(output["data"][key]),
+                        key, expected_type, type(value)
                     )
                 )
 
-        if self.data_validators[data_format] is not None:
-            self.data_validators[data_format](output["data"])
+        data_validator = self.data_validators[data_format]
+        if data_validator is not None:
+            data_validator(data)
 
     def validate_data_with_vertices(self, data):
         VERTEX_TYPE = [int, float]
         VERTEX_DIMENSIONS = 2
 
         vertices = data["vertices"]
-        if len(vertices) == 0:
-            return
+        if not isinstance(vertices, np.ndarray):
+            if len(vertices) == 0:
+                return
 
-        if not isinstance(vertices[0], list):
-            raise InvalidFormatException("Vertices needs to be a 2D array")
+            if not isinstance(vertices[0], list):
+                raise InvalidFormatException("Vertices needs to be a 2D array")
 
-        if len(vertices[0]) != VERTEX_DIMENSIONS:
-            raise InvalidFormatException(
-                "Each vertex needs to have only 2 values [x, y] got {} values.".format(
-                    len(vertices[0])
+            if len(vertices[0]) != VERTEX_DIMENSIONS:
+                raise InvalidFormatException(
+                    "Each vertex needs to have only 2 values [x, y] got {} values.".format(
+                        len(vertices[0])
+                    )
                 )
-            )
 
-        vertex = vertices[0]
-        if type(vertex[0]) not in VERTEX_TYPE or type(vertex[1]) not in VERTEX_TYPE:
+            vertex = vertices[0]
+            if (
+                value_type(vertex[0]) not in VERTEX_TYPE
+                or value_type(vertex[1]) not in VERTEX_TYPE
+            ):
+                raise InvalidFormatException(
+                    "Invalid vertex data type. Got {} Expected {}".format(
+                        [type(vertex[0]), type(vertex[1])], VERTEX_TYPE
+                    )
+                )
+
+            if not self.deep:
+                return
+            vertices = self.as_array(vertices, "Vertices")
+
+        self.validate_array(vertices, "Vertices", self.vertex_dtype_kinds)
+        if vertices.shape[1] != VERTEX_DIMENSIONS:
             raise InvalidFormatException(
-                "Invalid vertex data type. Got {} Expected {}".format(
-                    [type(vertex[0]), type(vertex[1])], VERTEX_TYPE
+                "Each vertex needs to have only 2 values [x, y] got {} values.".format(
+                    vertices.shape[1]
                 )
             )
 
@@ -149,22 +241,135 @@ class OutputValidator:
         MASK_TYPE = [int, float]
 
         mask = data.get("mask")
-        if len(mask) == 0:
+        if isinstance(mask, dict):
+            self.validate_encoded_mask(mask)
             return
 
-        if not isinstance(mask[0], list):
+        if not isinstance(mask, np.ndarray):
+            if len(mask) == 0:
+                return
+
+            if not isinstance(mask[0], list):
+                raise InvalidFormatException(
+                    "Mask needs to be returned as a 2D python list.\nNumpy arrays can be converted to lists using the .tolist() method, or encoded compactly with masks.encode_mask"
+                )
+
+            if len(mask[0]) != 0:
+                mask_value = mask[0][0]
+                if value_type(mask_value) not in MASK_TYPE:
+                    raise InvalidFormatException(
+                        "Invalid mask data type. Got {} Expected {}".format(
+                            type(mask_value), MASK_TYPE
+                        )
+                    )
+
+            if not self.deep:
+                return
+            mask = self.as_array(mask, "Mask")
+
+        self.validate_array(mask, "Mask", self.mask_dtype_kinds)
+        if self.deep and mask.dtype.kind in "if" and mask.size and mask.min() < 0:
+            raise InvalidFormatException("Mask values need to be non-negative")
+
+    def as_array(self, values, name):
+        """Convert nested lists to a numpy array in one pass, for deep validation."""
+        try:
+            array = np.asarray(values)
+        except ValueError:
+            array = None
+        if array is None or array.dtype.hasobject:
             raise InvalidFormatException(
-                "Mask needs to be returned as a 2D python list.\nNumpy arrays can be converted to lists using the .tolist() method"
+                "{} needs to be a 2D array with rows of equal length and numeric "
+                "values".format(name)
             )
+        return array
 
-        if len(mask[0]) == 0:
-            return
+    def validate_array(self, array, name, dtype_kinds):
+        if array.ndim != 2:
+            raise InvalidFormatException(
+                "{} needs to be a 2D array, got {} dimensions".format(name, array.ndim)
+            )
+        if array.dtype.kind not in dtype_kinds:
+            raise InvalidFormatException(
+                "Invalid {} array dtype. Got {}".format(name.lower(), array.dtype)
+            )
+        if self.deep and array.dtype.kind == "f" and not np.isfinite(array).all():
+            raise InvalidFormatException(
+                "{} contains NaN or infinite values".format(name)
+            )
+
+    def validate_probability(self, probability):
+        """Probabilities given as a numpy array are a scalar or one value per class."""
+        if probability.ndim > 1:
+            raise InvalidFormatException(
+                "Probability needs to be a scalar or 1D array, got {} dimensions".format(
+                    probability.ndim
+                )
+            )
+        if probability.dtype.kind not in self.probability_dtype_kinds:
+            raise InvalidFormatException(
+                "Invalid probability array dtype. Got {}".format(probability.dtype)
+            )
+        if self.deep and probability.dtype.kind == "f":
+            if not np.isfinite(probability).all():
+                raise InvalidFormatException(
+                    "Probability contains NaN or infinite values"
+                )
+
+    def validate_encoded_mask(self, mask):
+        if set(mask.keys()) != set(self.encoded_mask_types.keys()):
+            raise InvalidFormatException(
+                "Invalid keys for encoded mask. Got {} Expected {}".format(
+                    list(mask.keys()), list(self.encoded_mask_types.keys())
+                )
+            )
+
+        for key, expected_type in self.encoded_mask_types.items():
+            if not isinstance(mask[key], expected_type):
+                raise InvalidFormatException(
+                    "Invalid type for key '{}' in encoded mask. Expected {}, got {}".format(
+                        key, expected_type, type(mask[key])
+                    )
+                )
+
+        shape = mask["shape"]
+        if len(shape) != 2 or any(type(size) is not int or size < 0 for size in shape):
+            raise InvalidFormatException(
+                "Encoded mask shape needs to be [rows, columns], got {}".format(shape)
+            )
+
+        try:
+            np.dtype(mask["dtype"])
+        except TypeError:
+            raise InvalidFormatException(
+                "Invalid encoded mask dtype '{}'".format(mask["dtype"])
+            )
 
-        mask_value = mask[0][0]
-        if type(mask_value) not in MASK_TYPE:
+        size = shape[0] * shape[1]
+        encoding = mask["encoding"]
+        if encoding == "bitpack":
+            if len(mask["data"]) != (size + 7) // 8:
+                raise InvalidFormatException(
+                    "Bit-packed mask of shape {} needs {} bytes, got {}".format(
+                        shape, (size + 7) // 8, len(mask["data"])
+                    )
+                )
+        elif encoding == "rle":
+            if len(mask["data"]) % 4 != 0:
+                raise InvalidFormatException(
+                    "Run-length encoded mask data needs to be a uint32 array"
+                )
+            counts = np.frombuffer(mask["data"], dtype="<u4")
+            if int(counts.sum(dtype=np.uint64)) != size:
+                raise InvalidFormatException(
+                    "Run lengths of mask add up to {}, expected {} for shape {}".format(
+                        int(counts.sum(dtype=np.uint64)), size, shape
+                    )
+                )
+        else:
             raise InvalidFormatException(
-                "Invalid mask data type. Got {} Expected {}".format(
-                    type(mask_value), MASK_TYPE
+                "Invalid mask encoding. Got '{}' Expected one of {}".format(
+                    encoding, self.mask_encodings
                 )
             )
 
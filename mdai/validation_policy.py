@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import threading
+
+STRICT = "strict"
+SAMPLED = "sampled"
+SHADOW = "shadow"
+MODES = (STRICT, SAMPLED, SHADOW)
+
+logger = logging.getLogger("model")
+
+
+class ValidationPolicy:
+    """
+    Decides whether and how the outputs of each request are validated with `validate`, which is
+    called with a list of output lists and raises if any of them is invalid.
+
+    - 'strict': outputs of every request are validated before the response is sent.
+    - 'sampled': outputs of one in every `interval` requests are validated before the response is
+      sent. Responses to the other requests are sent without validation.
+    - 'shadow': responses are sent without waiting for validation. Outputs of one in every
+      `interval` requests are validated in the background on `shadow_executor`, and failures are
+      logged and counted. Requests, and each chunk of a streamed response, are skipped while
+      `max_pending` validations (unbounded if 0) are waiting, so a slow validator can not hold on
+      to the outputs of many requests.
+
+    Foreground validations run on `executor`.
+    """
+
+    def __init__(
+        self,
+        validate,
+        mode=STRICT,
+        interval=1,
+        max_pending=0,
+        executor=None,
+        shadow_executor=None,
+    ):
+        if mode not in MODES:
+            raise ValueError("Unknown validation mode '{}', expected one of {}".format(mode, MODES))
+        if interval < 1:
+            raise ValueError("Validation interval needs to be at least 1, got {}".format(interval))
+        self.validate_outputs = validate
+        self.mode = mode
+        self.interval = interval
+        self.max_pending = max_pending
+        self.executor = executor
+        self.shadow_executor = shadow_executor
+        self.requests = 0
+        self.validated = 0
+        self.skipped = 0
+        self.failed = 0
+        self.pending = 0
+        self.lock = threading.Lock()
+
+    def sample(self):
+        """Whether the outputs of the next request are to be validated."""
+        self.requests += 1
+        if self.mode != STRICT and (self.requests - 1) % self.interval != 0:
+            self.skipped += 1
+            return False
+        if self.mode == SHADOW and self.max_pending and self.pending >= self.max_pending:
+            self.skipped += 1
+            return False
+        return True
+
+    async def check(self, results_list):
+        """
+        Validate the outputs of a request if it is sampled, see `validate`. Returns whether they
+        were validated before returning, which is never the case in shadow mode.
+        """
+        if not self.sample():
+            return False
+        await self.validate(results_list)
+        return self.mode != SHADOW
+
+    async def validate(self, results_list):
+        """
+        Validate the outputs of a sampled request, or a chunk of them. Raises if they are invalid,
+        unless validation runs in the background in shadow mode, where they are skipped and counted
+        if `max_pending` validations are waiting.
+        """
+        if self.mode == SHADOW:
+            with self.lock:
+                if self.max_pending and self.pending >= self.max_pending:
+                    self.skipped += 1
+                    return
+                self.pending += 1
+            self.shadow_executor.submit(self.run_shadow, results_list)
+            return
+
+        try:
+            await asyncio.get_event_loop().run_in_executor(
+                self.executor, self.validate_outputs, results_list
+            )
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.validated += 1
+
+    def run_shadow(self, results_list):
+        try:
+            self.validate_outputs(results_list)
+            failed = 0
+        except Exception as e:
+            logger.error("Invalid data format returned by model (shadow validation): %s", e)
+            failed = 1
+        with self.lock:
+            self.pending -= 1
+            self.validated += 1
+            self.failed += failed
+
+    def stats(self):
+        with self.lock:
+            return {
+                "mode": self.mode,
+                "requests": self.requests,
+                "validated": self.validated,
+                "skipped": self.skipped,
+                "failed": self.failed,
+                "pending": self.pending,
+            }
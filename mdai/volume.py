@@ -0,0 +1,109 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pydicom
+
+from dicom import DICOM_CONTENT_TYPE, BufferReader
+
+# Slices whose orientations differ by more than this (in direction cosines) are not in one volume
+ORIENTATION_TOLERANCE = 1e-4
+
+
+class Volume:
+    """
+    A 3D image assembled from the slices of a DICOM series.
+
+    - `array`: contiguous array of shape (slices, rows, columns), with the rescale slope and
+      intercept of each slice applied, ordered along the normal of the slices
+    - `datasets`: header of each slice, in the same order, to map outputs back to instances
+    - `spacing`: distance in mm between slices, rows and columns
+    - `affine`: 4x4 matrix mapping (slice, row, column) indices to patient (LPS) coordinates in mm
+    """
+
+    def __init__(self, array, datasets, spacing, affine):
+        self.array = array
+        self.datasets = datasets
+        self.spacing = spacing
+        self.affine = affine
+
+
+def read_header(content):
+    return pydicom.dcmread(BufferReader(content), stop_before_pixels=True)
+
+
+def decode_slice(content, out):
+    """Decode the pixel data of a slice into `out`, applying its rescale slope and intercept."""
+    ds = pydicom.dcmread(BufferReader(content))
+    slope = float(ds.get("RescaleSlope", 1) or 1)
+    intercept = float(ds.get("RescaleIntercept", 0) or 0)
+    np.multiply(ds.pixel_array, slope, out=out, casting="unsafe")
+    if intercept:
+        out += intercept
+
+
+def assemble_volume(files, executor=None, dtype=np.float32):
+    """
+    Assemble the DICOM files of a request, single-frame slices of one series, into a `Volume`.
+
+    Slices are sorted by the distance of their ImagePositionPatient along the normal of their
+    ImageOrientationPatient, and their pixel data is decoded concurrently on `executor` (a new
+    thread pool if not given) straight into a preallocated array of `dtype`. Raises ValueError if
+    the slices do not share an orientation and size.
+    """
+    contents = [file["content"] for file in files if file["content_type"] == DICOM_CONTENT_TYPE]
+    if not contents:
+        raise ValueError("No DICOM files to assemble into a volume")
+    headers = [read_header(content) for content in contents]
+
+    first = headers[0]
+    orientation = np.array(first.ImageOrientationPatient, dtype=np.float64)
+    rows, columns = int(first.Rows), int(first.Columns)
+    for ds in headers:
+        if int(ds.get("NumberOfFrames") or 1) != 1 or int(ds.get("SamplesPerPixel", 1)) != 1:
+            raise ValueError("Volumes can only be assembled from single-frame grayscale slices")
+        if (int(ds.Rows), int(ds.Columns)) != (rows, columns):
+            raise ValueError("Slices of a volume need to have the same number of rows and columns")
+        if np.abs(np.array(ds.ImageOrientationPatient, dtype=np.float64) - orientation).max() > (
+            ORIENTATION_TOLERANCE
+        ):
+            raise ValueError("Slices of a volume need to have the same orientation")
+
+    row_cosine, column_cosine = orientation[:3], orientation[3:]
+    normal = np.cross(row_cosine, column_cosine)
+    positions = np.array([ds.ImagePositionPatient for ds in headers], dtype=np.float64)
+    order = np.argsort(positions @ normal, kind="stable")
+    positions = positions[order]
+    headers = [headers[index] for index in order]
+    contents = [contents[index] for index in order]
+
+    # Pixel spacing is the distance between rows, then between columns
+    row_spacing, column_spacing = (float(value) for value in first.PixelSpacing)
+    if len(headers) > 1:
+        step = (positions[-1] - positions[0]) / (len(headers) - 1)
+        slice_spacing = float(np.median(np.diff(positions @ normal)))
+    else:
+        slice_spacing = float(first.get("SliceThickness") or 1)
+        step = normal * slice_spacing
+
+    affine = np.eye(4)
+    affine[:3, 0] = step
+    affine[:3, 1] = column_cosine * row_spacing
+    affine[:3, 2] = row_cosine * column_spacing
+    affine[:3, 3] = positions[0]
+
+    array = np.empty((len(headers), rows, columns), dtype=dtype)
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor()
+    try:
+        futures = [
+            executor.submit(decode_slice, content, array[index])
+            for index, content in enumerate(contents)
+        ]
+        for future in futures:
+            future.result()
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+    spacing = (slice_spacing, row_spacing, column_spacing)
+    return Volume(array, headers, spacing, affine)
@@ -0,0 +1,174 @@
+import importlib
+import mmap
+import os
+import shlex
+import struct
+import subprocess
+import sys
+import threading
+import traceback
+from collections.abc import Iterator
+import msgpack
+
+from serialization import decode_numpy, encode_numpy
+
+# Each message is a msgpack payload preceded by its size in bytes
+FRAME_HEADER = struct.Struct(">Q")
+
+# Maps with exactly these keys are numpy arrays serialized by `encode_numpy`
+NUMPY_KEYS = {"dtype", "shape", "data"}
+
+# Request data that can not be sent to a worker process. Workers parse DICOM files themselves
+LOCAL_DATA_KEYS = {"datasets"}
+
+
+class WorkerError(RuntimeError):
+    """Raised when the worker process fails a request or exits."""
+
+
+def encode_value(obj):
+    """`default` hook for msgpack, adding spooled `mmap` file contents to `encode_numpy`."""
+    if isinstance(obj, mmap.mmap):
+        return memoryview(obj)
+    return encode_numpy(obj)
+
+
+def decode_value(obj):
+    """`object_hook` for msgpack, converting numpy arrays serialized by `encode_numpy` back."""
+    if obj.keys() == NUMPY_KEYS:
+        return decode_numpy(obj)
+    return obj
+
+
+def pack_message(message):
+    return msgpack.packb(message, use_bin_type=True, default=encode_value)
+
+
+def write_frame(stream, payload):
+    stream.write(FRAME_HEADER.pack(len(payload)))
+    stream.write(payload)
+    stream.flush()
+
+
+def read_exactly(stream, size):
+    chunks = []
+    while size:
+        chunk = stream.read(size)
+        if not chunk:
+            raise EOFError("Stream closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def read_frame(stream):
+    (size,) = FRAME_HEADER.unpack(read_exactly(stream, FRAME_HEADER.size))
+    return msgpack.unpackb(read_exactly(stream, size), raw=False, object_hook=decode_value)
+
+
+class WorkerModel:
+    """
+    Model running in a persistent worker process, for models that need their own environment,
+    such as Clara MMARs, instead of being imported by the server.
+
+    `command` is started once and kept running, so the model is loaded once instead of for every
+    request. It is expected to call `serve`, e.g. `python3 /src/worker.py module:MDAIModel`, and
+    is waited for until the model is loaded. Requests and outputs are exchanged as framed msgpack
+    messages over the process's stdin and stdout, one request at a time. If the process exits,
+    the request fails and it is restarted for the next one.
+
+    A server process forked after the worker was started launches its own worker.
+    """
+
+    def __init__(self, command, cwd=None):
+        self.command = shlex.split(command) if isinstance(command, str) else list(command)
+        self.cwd = cwd
+        self.process = None
+        self.pid = None
+        self.lock = threading.Lock()
+        self.start()
+
+    def start(self):
+        self.process = subprocess.Popen(
+            self.command, cwd=self.cwd, stdin=subprocess.PIPE, stdout=subprocess.PIPE
+        )
+        self.pid = os.getpid()
+        self.receive()
+
+    def receive(self):
+        try:
+            response = read_frame(self.process.stdout)
+        except EOFError as e:
+            self.process.kill()
+            raise WorkerError(
+                "Worker process exited with status {}".format(self.process.wait())
+            ) from e
+        if "error" in response:
+            raise WorkerError(response["error"])
+        return response
+
+    def running(self):
+        return self.pid == os.getpid() and self.process.poll() is None
+
+    def predict(self, data):
+        payload = pack_message(
+            {key: value for key, value in data.items() if key not in LOCAL_DATA_KEYS}
+        )
+        with self.lock:
+            if not self.running():
+                self.start()
+            try:
+                write_frame(self.process.stdin, payload)
+            except OSError:
+                # The process exited. Its status is reported by `receive`
+                pass
+            return self.receive()["outputs"]
+
+    def close(self):
+        with self.lock:
+            if self.process is not None and self.running():
+                self.process.stdin.close()
+                self.process.wait()
+
+
+def serve(create_model):
+    """
+    Create a model with `create_model`, such as a model class, run its `warmup` if it has one,
+    and run its `predict` on requests from a `WorkerModel` until its stdin is closed. Anything
+    written to stdout is redirected to stderr, so it can not corrupt the messages.
+    """
+    requests = os.fdopen(os.dup(sys.stdin.fileno()), "rb")
+    responses = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    sys.stdout.flush()
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    try:
+        model = create_model()
+        if hasattr(model, "warmup"):
+            model.warmup()
+    except Exception:
+        write_frame(responses, pack_message({"error": traceback.format_exc()}))
+        return
+    write_frame(responses, pack_message({"ready": True}))
+
+    while True:
+        try:
+            data = read_frame(requests)
+        except EOFError:
+            return
+        try:
+            outputs = model.predict(data)
+            # As in the server, only iterators are collected, so invalid outputs fail validation there
+            if isinstance(outputs, Iterator):
+                outputs = list(outputs)
+            payload = pack_message({"outputs": outputs})
+        except Exception:
+            payload = pack_message({"error": traceback.format_exc()})
+        write_frame(responses, payload)
+
+
+if __name__ == "__main__":
+    # The model is given as 'module:attribute', from the working directory
+    sys.path.insert(0, os.getcwd())
+    module_name, _, attribute = sys.argv[1].partition(":")
+    serve(lambda: getattr(importlib.import_module(module_name), attribute or "MDAIModel")())
@@ -0,0 +1,62 @@
+import math
+from mdai.admission import AdmissionController, AdmissionRejected, get_deadline
+import pytest
+
+
+class TestAdmissionController:
+    def test_unlimited_by_default(self):
+        admission = AdmissionController()
+        for _ in range(100):
+            assert admission.admit(10**9)
+        assert not admission.busy()
+
+    def test_request_limit(self):
+        admission = AdmissionController(max_requests=2)
+        assert admission.admit(1)
+        assert admission.admit(1)
+        assert not admission.admit(1)
+        admission.release(1)
+        assert admission.admit(1)
+
+    def test_byte_limit(self):
+        admission = AdmissionController(max_bytes=100)
+        assert admission.admit(60)
+        assert not admission.admit(50)
+        assert admission.admit(40)
+        assert admission.bytes == 100
+
+    def test_oversized_request_admitted_when_idle(self):
+        admission = AdmissionController(max_bytes=100)
+        assert admission.admit(1000)
+        assert not admission.admit(1)
+
+    def test_high_water(self):
+        admission = AdmissionController(high_water=2)
+        admission.admit(0)
+        assert not admission.busy()
+        admission.admit(0)
+        assert admission.busy()
+        admission.release(0)
+        assert not admission.busy()
+
+    def test_charge(self):
+        admission = AdmissionController(max_bytes=100)
+        admission.admit(0)
+        admission.charge(1000)
+        assert admission.admit(0) is False
+
+        other = AdmissionController(max_bytes=100)
+        other.admit(60)
+        other.admit(0)
+        other.charge(40)
+        with pytest.raises(AdmissionRejected):
+            other.charge(1)
+        assert other.bytes == 101
+
+
+def test_get_deadline():
+    assert get_deadline({}) is None
+    assert math.isfinite(get_deadline({"x-request-timeout": "1.5"}))
+    for value in ["0", "-1", "nan", "inf"]:
+        with pytest.raises(ValueError):
+            get_deadline({"x-request-timeout": value})
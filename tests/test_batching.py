@@ -0,0 +1,68 @@
+import asyncio
+from mdai.batching import BatchScheduler
+from mdai.replicas import ReplicaPool
+import pytest
+
+
+class TestBatchScheduler:
+    def run_requests(self, run_batch, inputs, models=(None,), **kwargs):
+        async def main():
+            scheduler = BatchScheduler(run_batch, ReplicaPool(models), **kwargs)
+            scheduler.start()
+            try:
+                return await asyncio.gather(
+                    *[scheduler.submit(data) for data in inputs], return_exceptions=True
+                )
+            finally:
+                scheduler.task.cancel()
+
+        return asyncio.run(main())
+
+    def test_groups_concurrent_requests(self):
+        batches = []
+
+        def run_batch(model, batch):
+            batches.append(list(batch))
+            return [[data * 2] for data in batch]
+
+        results = self.run_requests(run_batch, list(range(10)), max_batch_size=4, max_wait_ms=50)
+        assert results == [[data * 2] for data in range(10)]
+        assert [len(batch) for batch in batches] == [4, 4, 2]
+
+    def test_single_request_waits_at_most_max_wait(self):
+        results = self.run_requests(lambda model, batch: [[1]] * len(batch), [0], max_wait_ms=1)
+        assert results == [[1]]
+
+    def test_batch_error_is_delivered_to_every_request(self):
+        def run_batch(model, batch):
+            raise RuntimeError("model failed")
+
+        results = self.run_requests(run_batch, [0, 1, 2], max_batch_size=4)
+        assert all(isinstance(result, RuntimeError) for result in results)
+
+    def test_input_error_is_delivered_to_its_request(self):
+        def run_batch(model, batch):
+            return [ValueError(data) if data == 1 else [data] for data in batch]
+
+        results = self.run_requests(run_batch, [0, 1, 2], max_batch_size=4)
+        assert results[0] == [0] and results[2] == [2]
+        assert isinstance(results[1], ValueError)
+
+    def test_wrong_number_of_results(self):
+        results = self.run_requests(lambda model, batch: [[]], [0, 1], max_batch_size=2)
+        for result in results:
+            with pytest.raises(ValueError):
+                raise result
+
+    def test_batches_run_on_each_replica(self):
+        models = []
+
+        def run_batch(model, batch):
+            models.append(model)
+            return [model] * len(batch)
+
+        results = self.run_requests(
+            run_batch, list(range(4)), models=["a", "b"], max_batch_size=2, max_wait_ms=50
+        )
+        assert sorted(models) == ["a", "b"]
+        assert results[0] == results[1] and results[2] == results[3]
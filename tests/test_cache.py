@@ -0,0 +1,59 @@
+import os
+
+import msgpack
+from mdai.cache import ResultCache, file_keys, join_entries, pack_entry, request_key
+
+
+class TestResultCache:
+    def setup_method(self):
+        self.data = {
+            "files": [
+                {"content": b"first", "content_type": "application/dicom"},
+                {"content": b"second", "content_type": "application/dicom"},
+            ],
+            "annotations": [],
+            "label_classes": [],
+            "args": {"threshold": "0.5"},
+        }
+
+    def test_entries_join_into_packed_list(self):
+        outputs = [{"type": "NONE", "study_uid": "1"}, {"type": "NONE", "study_uid": "2"}]
+        entries = [pack_entry(outputs[:1]), pack_entry([]), pack_entry(outputs[1:])]
+        assert msgpack.unpackb(join_entries(entries)) == outputs
+
+    def test_keys(self):
+        key = request_key("1", self.data)
+        assert key == request_key("1", dict(self.data))
+        assert key != request_key("2", self.data)
+        assert key != request_key("1", dict(self.data, args={"threshold": "0.6"}))
+
+        keys = file_keys("1", self.data)
+        assert len(set(keys)) == 2
+        single = dict(self.data, files=self.data["files"][1:])
+        assert file_keys("1", single) == keys[1:]
+
+    def test_lru_eviction_by_bytes(self):
+        cache = ResultCache(max_bytes=10)
+        cache.put("a", (1, b"12345"))
+        cache.put("b", (1, b"12345"))
+        assert cache.get("a") is not None
+        cache.put("c", (1, b"12345"))
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert cache.get("c") is not None
+        cache.put("d", (1, b"12345678901"))
+        assert cache.get("d") is None
+        stats = cache.stats()
+        assert stats["bytes"] == 10
+        assert (stats["hits"], stats["misses"]) == (3, 2)
+
+    def test_disk_tier(self, tmp_path):
+        cache = ResultCache(max_bytes=5, directory=str(tmp_path), max_disk_bytes=100)
+        cache.put("a", (1, b"12345"))
+        cache.put("b", (2, b"67890"))
+        assert cache.get("a") == (1, b"12345")
+        assert cache.stats()["disk_hits"] == 1
+
+        reloaded = ResultCache(max_bytes=5, directory=str(tmp_path))
+        assert reloaded.get("b") == (2, b"67890")
+        assert not [name for name in os.listdir(str(tmp_path)) if name.endswith(".tmp")]
@@ -0,0 +1,130 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import mmap
+import multiprocessing
+from mdai.dicom import (
+    LazyDataset,
+    decode_datasets,
+    decode_reduced,
+    j2k_levels,
+    lazy_datasets,
+    parse_size,
+    reduce_image,
+    reduction_factor,
+)
+import numpy as np
+import pydicom
+from pydicom.data import get_testdata_file
+import pytest
+
+
+class TestDecodeDatasets:
+    def setup_method(self):
+        with open(get_testdata_file("CT_small.dcm"), "rb") as f:
+            self.content = f.read()
+
+    def test_decodes_dicom_files(self):
+        spooled = mmap.mmap(-1, len(self.content))
+        spooled.write(self.content)
+        files = [
+            {"content": self.content, "content_type": "application/dicom"},
+            {"content": "text", "content_type": "text/plain"},
+            {"content": spooled, "content_type": "application/dicom"},
+        ]
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            datasets = decode_datasets(files, executor, copy_content=True)
+        assert datasets[1] is None
+        for ds, pixels in (datasets[0], datasets[2]):
+            assert "_pixel_array" in ds.__dict__
+            assert pixels is ds.pixel_array
+            assert pixels.shape == (128, 128)
+
+    def test_decodes_in_processes(self):
+        files = [{"content": self.content, "content_type": "application/dicom"}]
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            [(ds, pixels)] = decode_datasets(files, executor, copy_content=True)
+        assert ds.Rows == 128
+        np.testing.assert_array_equal(pixels, ds.pixel_array)
+
+    def test_decodes_reduced(self):
+        files = [{"content": self.content, "content_type": "application/dicom"}]
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            [(ds, pixels)] = decode_datasets(files, executor, size=(50, 40))
+        assert pixels.shape == (64, 64)
+        assert pixels.dtype == ds.pixel_array.dtype
+
+    def test_invalid_file(self):
+        files = [{"content": b"not a dicom file", "content_type": "application/dicom"}]
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            with pytest.raises(Exception):
+                decode_datasets(files, executor)
+
+
+class TestLazyDataset:
+    def setup_method(self):
+        with open(get_testdata_file("CT_small.dcm"), "rb") as f:
+            self.content = f.read()
+
+    def test_reads_header_only_for_tags(self):
+        ds = LazyDataset(self.content)
+        assert ds._header is None
+        assert ds.InstanceNumber == 1
+        assert ds[0x0020, 0x0032].value == ds.ImagePositionPatient
+        assert ds.get("SliceLocation") is not None
+        assert "PatientName" in ds and "PatientComments" not in ds
+        assert ds._dataset is None
+
+    def test_reads_pixel_data_on_access(self):
+        ds = LazyDataset(self.content)
+        assert ds.pixel_array.shape == (128, 128)
+        assert ds._dataset is not None
+        assert "PixelData" in LazyDataset(self.content)
+
+    def test_reads_spooled_content(self):
+        spooled = mmap.mmap(-1, len(self.content))
+        spooled.write(self.content)
+        assert LazyDataset(spooled).Rows == 128
+
+    def test_lazy_datasets(self):
+        files = [
+            {"content": self.content, "content_type": "application/dicom"},
+            {"content": "text", "content_type": "text/plain"},
+        ]
+        datasets = lazy_datasets(files)
+        assert isinstance(datasets[0], LazyDataset) and datasets[1] is None
+
+
+class TestReducedDecode:
+    def test_parse_size(self):
+        assert parse_size("224") == (224, 224)
+        assert parse_size("[256, 128]") == (256, 128)
+        assert parse_size("") is None
+        with pytest.raises(ValueError):
+            parse_size("1,2,3")
+
+    def test_reduction_factor(self):
+        assert reduction_factor(3000, 3000, (224, 224)) == 8
+        assert reduction_factor(3000, 2000, (224, 224)) == 8
+        assert reduction_factor(448, 448, (224, 224)) == 2
+        assert reduction_factor(446, 448, (224, 224)) == 1
+
+    def test_reduce_image(self):
+        image = np.arange(25, dtype=np.uint16).reshape(5, 5)
+        reduced = reduce_image(image, 2)
+        assert reduced.shape == (3, 3) and reduced.dtype == np.uint16
+        assert reduced[0, 0] == 3 and reduced[2, 2] == 24
+        assert reduce_image(np.zeros((8, 8, 3)), 4).shape == (2, 2, 3)
+
+    def test_decode_reduced(self):
+        path = get_testdata_file("CT_small.dcm")
+        ds = pydicom.dcmread(path)
+        pixels = decode_reduced(ds, (32, 32))
+        np.testing.assert_array_equal(pixels, reduce_image(ds.pixel_array, 4))
+        with open(path, "rb") as f:
+            assert decode_reduced(LazyDataset(f.read()), (200, 200)).shape == (128, 128)
+
+    def test_j2k_levels(self):
+        siz = b"\xff\x51\x00\x04\x00\x00"
+        cod = b"\xff\x52\x00\x0c\x00\x00\x00\x01\x00\x06\x04\x04\x00\x00"
+        assert j2k_levels(b"\xff\x4f" + siz + cod) == 6
+        assert j2k_levels(b"\xff\x4f" + siz) == 0
@@ -0,0 +1,77 @@
+from mdai import frames as frames_module
+from mdai.frames import chunk_frames, dicom_frames, iter_frames, video_file
+import numpy as np
+import pydicom
+from pydicom.data import get_testdata_file
+import pytest
+
+
+def read_content(name):
+    with open(get_testdata_file(name), "rb") as f:
+        return f.read()
+
+
+class TestDicomFrames:
+    @pytest.mark.parametrize("name", ["rtdose.dcm", "rtdose_rle.dcm", "SC_rgb_rle_2frame.dcm"])
+    def test_frames_match_pixel_array(self, name):
+        expected = pydicom.dcmread(get_testdata_file(name)).pixel_array
+        frames = list(dicom_frames(read_content(name)))
+
+        assert [index for index, _ in frames] == list(range(len(expected)))
+        for index, frame in frames:
+            assert frame.dtype == expected.dtype
+            np.testing.assert_array_equal(frame, expected[index])
+
+    @pytest.mark.parametrize("name", ["rtdose.dcm", "rtdose_rle.dcm"])
+    def test_start_and_stride(self, name):
+        expected = pydicom.dcmread(get_testdata_file(name)).pixel_array
+        frames = list(dicom_frames(read_content(name), start=2, stride=5))
+
+        assert [index for index, _ in frames] == [2, 7, 12]
+        np.testing.assert_array_equal(frames[1][1], expected[7])
+
+    def test_skipped_frames_not_decoded(self, monkeypatch):
+        decoded = []
+        frame_dataset = frames_module.frame_dataset
+
+        def tracking_frame_dataset(ds, frame):
+            decoded.append(frame)
+            return frame_dataset(ds, frame)
+
+        monkeypatch.setattr(frames_module, "frame_dataset", tracking_frame_dataset)
+        frames = list(dicom_frames(read_content("rtdose_rle.dcm"), start=2, stride=5))
+        assert len(frames) == len(decoded) == 3
+
+    def test_native_frames_are_views(self):
+        _, frame = next(dicom_frames(read_content("rtdose.dcm")))
+        assert not frame.flags.owndata and not frame.flags.writeable
+
+    def test_single_frame(self):
+        expected = pydicom.dcmread(get_testdata_file("CT_small.dcm")).pixel_array
+        frames = list(dicom_frames(read_content("CT_small.dcm")))
+
+        assert len(frames) == 1 and frames[0][0] == 0
+        np.testing.assert_array_equal(frames[0][1], expected)
+
+
+class TestChunkFrames:
+    def test_chunks(self):
+        frames = ((index, np.full((2, 2), index)) for index in range(5))
+        chunks = list(chunk_frames(frames, 2))
+
+        assert [numbers for numbers, _ in chunks] == [[0, 1], [2, 3], [4]]
+        assert chunks[0][1].shape == (2, 2, 2) and chunks[2][1].shape == (1, 2, 2)
+
+    def test_iter_frames_chunks_dicom(self):
+        file = {"content": read_content("rtdose.dcm"), "content_type": "application/dicom"}
+        chunks = list(iter_frames(file, stride=3, chunk_size=4))
+
+        assert [numbers for numbers, _ in chunks] == [[0, 3, 6, 9], [12]]
+        assert chunks[0][1].shape == (4, 10, 10)
+
+
+def test_video_file():
+    content = b"\x00\x01video" * 100
+    with video_file(memoryview(content)) as path:
+        with open(path, "rb") as f:
+            assert f.read() == content
@@ -0,0 +1,38 @@
+from mdai.masks import encode_mask, decode_mask
+import numpy as np
+import pytest
+
+
+class TestMasks:
+    def setup_method(self):
+        rng = np.random.RandomState(0)
+        self.masks = [
+            (rng.rand(37, 53) > 0.5).astype(np.uint8),
+            np.ones((4, 4), dtype=bool),
+            np.zeros((5, 3), dtype=np.int32),
+            np.zeros((0, 0), dtype=np.uint8),
+        ]
+
+    @pytest.mark.parametrize("encoding", ["bitpack", "rle"])
+    def test_round_trip(self, encoding):
+        for mask in self.masks:
+            encoded = encode_mask(mask, encoding)
+            assert encoded["shape"] == list(mask.shape)
+            assert isinstance(encoded["data"], bytes)
+            decoded = decode_mask(encoded)
+            assert decoded.dtype == mask.dtype
+            np.testing.assert_array_equal(decoded, mask)
+
+    def test_bitpack_layout(self):
+        encoded = encode_mask([[1, 1, 1, 1, 0, 0, 0, 0, 1]])
+        assert encoded["data"] == b"\xf0\x80"
+
+    def test_rle_starts_with_background_run(self):
+        encoded = encode_mask([[1, 1, 0, 0, 0]], "rle")
+        assert np.frombuffer(encoded["data"], dtype="<u4").tolist() == [0, 2, 3]
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            encode_mask(np.zeros(4))
+        with pytest.raises(ValueError):
+            encode_mask(np.zeros((2, 2)), "png")
@@ -0,0 +1,23 @@
+import tracemalloc
+from mdai.memory import current_rss, peak_rss, reclaim_memory, traced_memory
+
+
+def test_rss():
+    assert current_rss() > 0 and peak_rss() > 0
+
+
+def test_reclaim_memory():
+    blocks = [bytearray(1024) for _ in range(10000)]
+    del blocks
+    assert reclaim_memory() >= 0
+
+
+def test_traced_memory():
+    assert traced_memory() == (0, 0)
+    tracemalloc.start()
+    try:
+        block = bytearray(1 << 20)
+        current, peak = traced_memory()
+        assert peak >= current >= len(block)
+    finally:
+        tracemalloc.stop()
@@ -0,0 +1,86 @@
+import tracemalloc
+from mdai.metrics import MetricsRegistry, RequestStats
+
+
+class TestMetricsRegistry:
+    def test_histogram(self):
+        registry = MetricsRegistry()
+        histogram = registry.histogram("phase_seconds", "Phase time", (0.1, 1), labels=("phase",))
+        for value in [0.05, 0.1, 0.5, 2]:
+            histogram.observe(value, "predict")
+
+        lines = registry.render().splitlines()
+        assert lines[:2] == ["# HELP phase_seconds Phase time", "# TYPE phase_seconds histogram"]
+        assert lines[2:] == [
+            'phase_seconds_bucket{phase="predict",le="0.1"} 2',
+            'phase_seconds_bucket{phase="predict",le="1.0"} 3',
+            'phase_seconds_bucket{phase="predict",le="+Inf"} 4',
+            'phase_seconds_sum{phase="predict"} 2.65',
+            'phase_seconds_count{phase="predict"} 4',
+        ]
+
+    def test_counter_and_gauge(self):
+        registry = MetricsRegistry()
+        errors = registry.counter("errors_total", "Errors", labels=("phase",))
+        errors.inc("model")
+        errors.inc("read", amount=2)
+        errors.inc("model")
+        registry.gauge("in_flight", "Requests", lambda: 3)
+        registry.gauge("startup_seconds", "Startup", lambda: {("import",): 1.5}, labels=("phase",))
+
+        samples = [line for line in registry.render().splitlines() if not line.startswith("#")]
+        assert samples == [
+            'errors_total{phase="model"} 2.0',
+            'errors_total{phase="read"} 2.0',
+            "in_flight 3.0",
+            'startup_seconds{phase="import"} 1.5',
+        ]
+
+
+def test_request_stats():
+    stats = RequestStats()
+    with stats.time("predict"):
+        pass
+    stats.add("read", 0.5)
+    stats.add("read", 0.25)
+
+    assert list(stats.phases) == ["predict", "read"]
+    assert stats.phases["read"] == 0.75
+
+
+def test_request_timing_and_log():
+    stats = RequestStats("request-1")
+    stats.add("read", 0.0015)
+    stats.add("predict", 0.25)
+    stats.files = 2
+    stats.outputs = 3
+
+    timing = stats.server_timing().split(", ")
+    assert timing[:2] == ["read;dur=1.500", "predict;dur=250.000"]
+    assert timing[2].startswith("total;dur=")
+
+    record = stats.log_record(200)
+    assert record["request_id"] == "request-1" and record["status"] == 200
+    assert record["phases_ms"] == {"read": 1.5, "predict": 250.0}
+    assert record["files"] == 2 and record["outputs"] == 3
+    assert record["peak_rss_delta_bytes"] >= 0
+    assert 0 < record["rss_start_bytes"] <= record["rss_peak_bytes"]
+    assert record["traced_peak_bytes"] == 0
+    assert RequestStats().request_id != RequestStats().request_id
+
+
+def test_request_memory():
+    tracemalloc.start()
+    try:
+        stats = RequestStats()
+        with stats.time("predict"):
+            block = bytearray(1 << 20)
+        assert stats.traced_peak - stats.traced_start >= len(block)
+
+        # Requests starting later do not lower the peak of requests in flight
+        RequestStats()
+        del block
+        stats.add("pack", 0)
+        assert stats.traced_peak - stats.traced_start >= 1 << 20
+    finally:
+        tracemalloc.stop()
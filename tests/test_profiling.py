@@ -0,0 +1,55 @@
+import asyncio
+from mdai.profiling import ProfileCapture
+import pytest
+
+
+def busy_function(size):
+    return sum(range(size))
+
+
+def capture_requests(mode, work, count=2):
+    """Capture a profile while `count` requests run `work`, returning the report."""
+
+    async def main():
+        capture = ProfileCapture(mode, requests=count, top=20)
+        capture.start()
+        waiter = asyncio.ensure_future(capture.wait())
+        loop = asyncio.get_event_loop()
+        for _ in range(count):
+            await loop.run_in_executor(None, capture.run, work)
+            capture.request_done()
+        await waiter
+        return capture.report()
+
+    return asyncio.run(main())
+
+
+class TestProfileCapture:
+    def test_cprofile(self):
+        report = capture_requests("cprofile", lambda: busy_function(10000))
+        assert report.startswith("# mode=cprofile requests=2")
+        assert "busy_function" in report
+
+    def test_sample(self):
+        async def main():
+            capture = ProfileCapture("sample", seconds=0.05)
+            capture.start()
+            await capture.wait()
+            return capture.report()
+
+        lines = asyncio.run(main()).splitlines()
+        assert lines[0].startswith("# mode=sample")
+        stack, count = lines[1].rsplit(" ", 1)
+        assert ";" in stack and int(count) > 0
+
+    def test_tracemalloc(self):
+        held = []
+        report = capture_requests("tracemalloc", lambda: held.append(bytearray(1 << 20)))
+        assert "+2048." in report
+        assert "test_profiling.py" in report
+
+    def test_invalid(self):
+        with pytest.raises(ValueError, match="Unknown profile mode"):
+            ProfileCapture("perf", requests=1)
+        with pytest.raises(ValueError, match="requests or of seconds"):
+            ProfileCapture("cprofile")
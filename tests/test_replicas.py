@@ -0,0 +1,59 @@
+import asyncio
+from mdai.replicas import ReplicaPool
+import pytest
+
+
+class TestReplicaPool:
+    def test_checkout_and_release(self):
+        async def main():
+            pool = ReplicaPool(["a", "b"])
+            first = await pool.acquire()
+            second = await pool.acquire()
+            assert {first.model, second.model} == {"a", "b"}
+            pool.release(first)
+            third = await pool.acquire()
+            assert third is first
+            return pool
+
+        pool = asyncio.run(main())
+        stats = pool.utilization()
+        assert [replica["checkouts"] for replica in stats] == [1, 0]
+        assert [replica["busy"] for replica in stats] == [True, True]
+
+    def test_waits_for_release(self):
+        async def main():
+            pool = ReplicaPool(["a"])
+            replica = await pool.acquire()
+            waiter = asyncio.ensure_future(pool.acquire())
+            await asyncio.sleep(0)
+            assert not waiter.done()
+            pool.release(replica)
+            return await waiter
+
+        assert asyncio.run(main()).model == "a"
+
+    def test_timeout(self):
+        async def main():
+            pool = ReplicaPool(["a"])
+            replica = await pool.acquire()
+            with pytest.raises(asyncio.TimeoutError):
+                await pool.acquire(timeout=0.01)
+            pool.release(replica)
+            assert not pool.waiters
+            return await pool.acquire(timeout=0.01)
+
+        assert asyncio.run(main()).model == "a"
+
+    def test_cancelled_waiter_does_not_lose_replica(self):
+        async def main():
+            pool = ReplicaPool(["a"])
+            replica = await pool.acquire()
+            waiter = asyncio.ensure_future(pool.acquire())
+            await asyncio.sleep(0)
+            pool.release(replica)
+            waiter.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiter
+            return await pool.acquire(timeout=0.01)
+
+        assert asyncio.run(main()).model == "a"
@@ -0,0 +1,111 @@
+import asyncio
+from io import BytesIO
+import mmap
+import tracemalloc
+import msgpack
+from mdai.serialization import (
+    AsyncStreamReader,
+    decode_numpy,
+    decode_request_stream,
+    encode_numpy,
+)
+import numpy as np
+import pytest
+
+
+class TestRequestDecoder:
+    def setup_method(self):
+        self.request = {
+            "files": [
+                {"content": b"\x00" * 10, "content_type": "application/dicom"},
+                {"content": bytes(range(256)) * 10000, "content_type": "application/dicom"},
+                {"content": "text", "content_type": "text/plain"},
+            ],
+            "annotations": [{"id": "A_1", "data": None}],
+            "label_classes": [],
+            "args": {"threshold": "0.5"},
+        }
+        self.body = msgpack.packb(self.request, use_bin_type=True)
+
+    def test_matches_unpackb(self):
+        assert decode_request_stream(BytesIO(self.body)) == msgpack.unpackb(self.body, raw=False)
+
+    def test_large_content_single_copy(self):
+        content = bytes(range(256)) * 40000
+        body = msgpack.packb({"files": [{"content": content}]}, use_bin_type=True)
+        tracemalloc.start()
+        try:
+            data = decode_request_stream(BytesIO(body))
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        assert data["files"][0]["content"] == content
+        # Well below the two copies of a join of the chunks
+        assert peak < 1.5 * len(content)
+
+    def test_spooled_content(self):
+        data = decode_request_stream(BytesIO(self.body), spool_threshold=1000)
+        assert data["files"][0]["content"] == self.request["files"][0]["content"]
+        content = data["files"][1]["content"]
+        assert isinstance(content, mmap.mmap)
+        assert content[:] == self.request["files"][1]["content"]
+
+    def test_truncated_body(self):
+        with pytest.raises(Exception):
+            decode_request_stream(BytesIO(self.body[:-100]))
+
+    def test_async_stream(self):
+        async def stream():
+            for i in range(0, len(self.body), 1000):
+                yield self.body[i : i + 1000]
+
+        async def main():
+            loop = asyncio.get_event_loop()
+            reader = AsyncStreamReader(stream(), loop)
+            return await loop.run_in_executor(None, decode_request_stream, reader)
+
+        assert asyncio.run(main()) == self.request
+
+    def test_async_stream_stopped(self):
+        async def stream():
+            for i in range(0, len(self.body), 1000):
+                yield self.body[i : i + 1000]
+
+        def on_chunk(bytes_read):
+            if bytes_read > 5000:
+                raise OverflowError("Too large")
+
+        async def main():
+            loop = asyncio.get_event_loop()
+            reader = AsyncStreamReader(stream(), loop, on_chunk)
+            return await loop.run_in_executor(None, decode_request_stream, reader)
+
+        with pytest.raises(OverflowError):
+            asyncio.run(main())
+
+
+class TestEncodeNumpy:
+    def pack(self, obj):
+        return msgpack.unpackb(msgpack.packb(obj, use_bin_type=True, default=encode_numpy))
+
+    def test_scalars(self):
+        output = {"class_index": np.int64(3), "probability": np.float32(0.5), "flag": np.bool_(1)}
+        assert self.pack(output) == {"class_index": 3, "probability": 0.5, "flag": True}
+
+    def test_arrays(self):
+        arrays = [
+            np.arange(12, dtype=np.float32).reshape(3, 4),
+            np.arange(12, dtype=">i2").reshape(3, 4)[:, ::2],
+            np.ones((0, 2), dtype=np.int64),
+            np.array(1.5),
+        ]
+        for array in arrays:
+            packed = self.pack({"mask": array})["mask"]
+            assert set(packed) == {"dtype", "shape", "data"}
+            decoded = decode_numpy(packed)
+            assert decoded.dtype == array.dtype
+            np.testing.assert_array_equal(decoded, array)
+
+    def test_unsupported(self):
+        with pytest.raises(TypeError):
+            self.pack({"value": object()})
@@ -0,0 +1,217 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
+import msgpack
+import pytest
+
+os.environ.setdefault("MDAI_PATH", os.path.dirname(__file__))
+os.environ.setdefault("MDAI_ACCESS_LOG", "false")
+
+from mdai import server  # noqa: E402
+
+SCOPE = {
+    "type": "http",
+    "asgi": {"version": "3.0"},
+    "http_version": "1.1",
+    "method": "POST",
+    "scheme": "http",
+    "path": "/inference",
+    "raw_path": b"/inference",
+    "query_string": b"",
+    "root_path": "",
+    "client": ("127.0.0.1", 1),
+    "server": ("127.0.0.1", 6324),
+}
+
+
+class StreamingModel:
+    def __init__(self):
+        self.closed = False
+
+    def predict(self, data):
+        if data["args"].get("fail"):
+            raise ValueError("bad input")
+        if data["args"].get("none"):
+            return None
+        if not data["args"].get("stream"):
+            return [{"type": "NONE", "study_uid": "1"}]
+        return self.outputs()
+
+    def outputs(self):
+        try:
+            while True:
+                time.sleep(0.001)
+                yield {"type": "NONE", "study_uid": "1"}
+        finally:
+            self.closed = True
+
+
+@pytest.fixture
+def model():
+    model = StreamingModel()
+    server.mdai_models = [model]
+    server.mdai_model = model
+    server.start_model()
+    yield model
+    server.mdai_model_ready = False
+
+
+def request_body(**args):
+    files = [{"content": b"x", "content_type": "text/plain"}]
+    return msgpack.packb({"files": files, "annotations": [], "label_classes": [], "args": args})
+
+
+async def call(body, headers, disconnect_after=None):
+    """Run an ASGI request, disconnecting after `disconnect_after` streamed chunks if set."""
+    chunks = 0
+    chunk_sent = asyncio.Event()
+    received = False
+    messages = []
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        while disconnect_after is None or chunks < disconnect_after:
+            chunk_sent.clear()
+            await chunk_sent.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal chunks
+        messages.append(message)
+        if message["type"] == "http.response.body" and message.get("body"):
+            chunks += 1
+            chunk_sent.set()
+        if disconnect_after is not None and chunks > disconnect_after:
+            raise OSError("Client disconnected")
+
+    scope = dict(
+        SCOPE, headers=[(name.encode(), value.encode()) for name, value in headers.items()]
+    )
+    try:
+        await server.app(scope, receive, send)
+    except OSError:
+        pass
+    return messages
+
+
+def test_stream_disconnect_releases_replica(model):
+    async def main():
+        headers = {"content-type": "application/msgpack"}
+        stream_headers = dict(headers, accept=server.STREAM_CONTENT_TYPE)
+        await call(request_body(stream=True), stream_headers, disconnect_after=2)
+
+        # Background tasks closing the stream may still be running
+        for _ in range(100):
+            if server.app.state.replicas.idle:
+                break
+            await asyncio.sleep(0.01)
+        assert len(server.app.state.replicas.idle) == 1
+        assert model.closed
+
+        messages = await asyncio.wait_for(call(request_body(), headers), 5)
+        assert messages[0]["status"] == 200
+
+    asyncio.run(main())
+
+
+def test_coalesced_follower_ignores_leader_deadline(model, monkeypatch):
+    monkeypatch.setattr(server, "COALESCE_REQUESTS", True)
+
+    async def main():
+        headers = {"content-type": "application/msgpack"}
+        # The only replica is busy, so the leader's deadline expires while waiting for it
+        replica = await server.app.state.replicas.acquire()
+        leader = asyncio.ensure_future(
+            call(request_body(), dict(headers, **{"x-request-timeout": "0.05"}))
+        )
+        await asyncio.sleep(0.01)
+        follower = asyncio.ensure_future(call(request_body(), headers))
+        assert (await leader)[0]["status"] == 503
+        server.app.state.replicas.release(replica)
+        assert (await asyncio.wait_for(follower, 5))[0]["status"] == 200
+
+    asyncio.run(main())
+
+
+def test_invalid_results(model):
+    async def main():
+        messages = await call(request_body(none=True), {"content-type": "application/msgpack"})
+        assert messages[0]["status"] == 500
+        assert b"Expected list" in messages[1]["body"]
+
+    asyncio.run(main())
+
+
+def test_batched_request_error(model, monkeypatch):
+    monkeypatch.setattr(server, "MAX_BATCH_SIZE", 4)
+    monkeypatch.setattr(server, "BATCH_WAIT_MS", 50)
+
+    async def main():
+        server.start_model()
+        try:
+            headers = {"content-type": "application/msgpack"}
+            failing, valid = await asyncio.gather(
+                call(request_body(fail=True), headers), call(request_body(), headers)
+            )
+        finally:
+            server.batch_scheduler.task.cancel()
+            server.batch_scheduler = None
+        assert failing[0]["status"] == 500 and b"bad input" in failing[1]["body"]
+        assert valid[0]["status"] == 200
+
+    asyncio.run(main())
+
+
+def test_slow_upload_does_not_hold_compute_threads(model, monkeypatch):
+    monkeypatch.setattr(server, "compute_executor", ThreadPoolExecutor(max_workers=1))
+    headers = {"content-type": "application/msgpack"}
+
+    async def main():
+        stalled = asyncio.Event()
+
+        async def receive():
+            if not stalled.is_set():
+                stalled.set()
+                return {"type": "http.request", "body": request_body()[:5], "more_body": True}
+            await asyncio.Event().wait()
+
+        async def send(message):
+            pass
+
+        scope = dict(SCOPE, headers=[(b"content-type", b"application/msgpack")])
+        upload = asyncio.ensure_future(server.app(scope, receive, send))
+        await stalled.wait()
+        try:
+            messages = await asyncio.wait_for(call(request_body(), headers), 5)
+            assert messages[0]["status"] == 200
+        finally:
+            upload.cancel()
+
+    asyncio.run(main())
+
+
+def test_coalesced_requests_get_own_headers(model, monkeypatch):
+    monkeypatch.setattr(server, "COALESCE_REQUESTS", True)
+
+    async def main():
+        headers = {"content-type": "application/msgpack"}
+        # Both requests wait for the only replica, so the second joins the first
+        replica = await server.app.state.replicas.acquire()
+        leader = asyncio.ensure_future(
+            call(request_body(), dict(headers, **{"x-request-id": "AAA"}))
+        )
+        await asyncio.sleep(0.01)
+        follower = asyncio.ensure_future(
+            call(request_body(), dict(headers, **{"x-request-id": "BBB"}))
+        )
+        await asyncio.sleep(0.01)
+        server.app.state.replicas.release(replica)
+        for messages, request_id in ((await leader, b"AAA"), (await follower, b"BBB")):
+            assert messages[0]["status"] == 200
+            assert dict(messages[0]["headers"])[b"x-request-id"] == request_id
+
+    asyncio.run(main())
@@ -0,0 +1,45 @@
+import asyncio
+from mdai.singleflight import SingleFlight
+import pytest
+
+
+class TestSingleFlight:
+    def test_coalesces_concurrent_calls(self):
+        calls = []
+
+        async def work(value):
+            calls.append(value)
+            await asyncio.sleep(0.01)
+            return value
+
+        async def main():
+            group = SingleFlight()
+            results = await asyncio.gather(
+                group.run("a", lambda: work(1)),
+                group.run("a", lambda: work(2)),
+                group.run("b", lambda: work(3)),
+            )
+            assert not group.calls
+            # Calls made after the first one completed run again
+            results.append(await group.run("a", lambda: work(4)))
+            return group, results
+
+        group, results = asyncio.run(main())
+        assert results == [1, 1, 3, 4]
+        assert calls == [1, 3, 4]
+        assert group.coalesced == 1
+
+    def test_timeout_does_not_cancel_shared_call(self):
+        async def work():
+            await asyncio.sleep(0.05)
+            return "done"
+
+        async def main():
+            group = SingleFlight()
+            first = asyncio.ensure_future(group.run("a", work))
+            await asyncio.sleep(0)
+            with pytest.raises(asyncio.TimeoutError):
+                await group.run("a", work, timeout=0.01)
+            return await first
+
+        assert asyncio.run(main()) == "done"
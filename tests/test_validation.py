@@ -1,10 +1,11 @@
 from mdai.validation import OutputValidator
 from mdai.validation import InvalidFormatException
+import numpy as np
 import pytest
 
 
 class TestOutputValidator:
-    def setup(self):
+    def setup_method(self):
         self.output_validator = OutputValidator()
 
         self.sample_output = {
@@ -75,7 +76,6 @@ class TestOutputValidator:
             {"vertex": [[1, 2], [3, 4]]},
             {"vetices": [1, 2, 3, 4]},
             {"vertices": [[1, 2, 3], [4, 5]]},
-            {"vertices": [[0.1, 0.2], [0.3, 0.4]]},
             {"x": 50, "y": 50, "z": 50},
             {"x": 0.1, "y": 0.5},
             {"x": 50, "y": 50, "width": 50.5, "height": 50.5},
@@ -90,3 +90,107 @@ class TestOutputValidator:
             with pytest.raises(InvalidFormatException):
                 self.output_validator.validate([output])
             output[key] = prev_value
+
+        # Vertices may be given in sub-pixel coordinates
+        output["data"] = {"vertices": [[0.1, 0.2], [0.3, 0.4]]}
+        self.output_validator.validate([output])
+
+    def test_encoded_mask(self):
+        output = dict(self.sample_output)
+        valid_masks = [
+            {"encoding": "bitpack", "shape": [3, 4], "dtype": "uint8", "data": b"\x0f\xf0"},
+            {"encoding": "bitpack", "shape": [0, 0], "dtype": "bool", "data": b""},
+            {"encoding": "rle", "shape": [2, 2], "dtype": "uint8", "data": b"\x01\0\0\0\x03\0\0\0"},
+        ]
+        for mask in valid_masks:
+            output["data"] = {"mask": mask}
+            self.output_validator.validate([output])
+
+        invalid_masks = [
+            {"encoding": "bitpack", "shape": [3, 4], "dtype": "uint8"},
+            {"encoding": "bitpack", "shape": [3, 4], "dtype": "uint8", "data": b"\x0f"},
+            {"encoding": "bitpack", "shape": [12], "dtype": "uint8", "data": b"\x0f\xf0"},
+            {"encoding": "bitpack", "shape": [3, 4], "dtype": "uint9", "data": b"\x0f\xf0"},
+            {"encoding": "bitpack", "shape": [3, 4], "dtype": "uint8", "data": [15, 240]},
+            {"encoding": "rle", "shape": [2, 2], "dtype": "uint8", "data": b"\x01\0\0\0\x02\0\0\0"},
+            {"encoding": "rle", "shape": [2, 2], "dtype": "uint8", "data": b"\x04\0\0"},
+            {"encoding": "png", "shape": [2, 2], "dtype": "uint8", "data": b""},
+        ]
+        for mask in invalid_masks:
+            output["data"] = {"mask": mask}
+            with pytest.raises(InvalidFormatException):
+                self.output_validator.validate([output])
+
+    def test_numpy_values(self):
+        output = dict(self.sample_output)
+        output["class_index"] = np.int64(1)
+        output["frame_number"] = np.uint16(2)
+        for probability in [np.float32(0.5), np.array([0.2, 0.8])]:
+            output["probability"] = probability
+            self.output_validator.validate([output])
+
+        valid_data_fields = [
+            {"x": np.int32(35), "y": np.int32(45)},
+            {"vertices": np.array([[1.5, 2.5], [3.5, 4.5]], dtype=np.float32)},
+            {"vertices": [[np.int64(1), np.int64(2)]]},
+            {"mask": np.zeros((4, 5), dtype=bool)},
+            {"mask": [[np.uint8(0), np.uint8(1)]]},
+        ]
+        for data_field in valid_data_fields:
+            output["data"] = data_field
+            self.output_validator.validate([output])
+
+        invalid_outputs = [
+            {"class_index": np.float64(1.0)},
+            {"class_index": np.array(1)},
+            {"data": {"vertices": np.zeros((4, 3))}},
+            {"data": {"vertices": np.zeros(4)}},
+            {"data": {"mask": np.zeros((2, 2), dtype=np.complex64)}},
+            {"data": {"mask": np.zeros((2, 2, 2))}},
+            {"probability": np.array(["0.5"])},
+            {"probability": np.array([0.5], dtype=object)},
+            {"probability": np.zeros((2, 2))},
+        ]
+        for invalid_output in invalid_outputs:
+            with pytest.raises(InvalidFormatException):
+                self.output_validator.validate([dict(self.sample_output, **invalid_output)])
+
+    def test_unknown_key(self):
+        output = dict(self.sample_output, score=0.5)
+        with pytest.raises(InvalidFormatException):
+            self.output_validator.validate([output])
+
+    def test_deep_validation(self):
+        deep_validator = OutputValidator(deep=True)
+        output = dict(self.sample_output)
+        valid_data_fields = [
+            {"vertices": [[1, 2], [3.5, 4.5], [5, 6]]},
+            {"mask": [[0, 1], [1, 0]]},
+            {"mask": [[]]},
+            {"mask": np.ones((3, 3), dtype=bool)},
+        ]
+        for data_field in valid_data_fields:
+            output["data"] = data_field
+            deep_validator.validate([output])
+
+        # Only detected when every element is checked
+        invalid_data_fields = [
+            {"vertices": [[1, 2], [3, 4, 5]]},
+            {"vertices": [[1, 2], [3, "4"]]},
+            {"vertices": [[1, 2], [float("nan"), 4]]},
+            {"mask": [[0, 1], [1]]},
+            {"mask": [[0, 1], [1, None]]},
+            {"mask": [[0, 1], [1, -1]]},
+            {"mask": [[], [1]]},
+            {"mask": np.full((2, 2), np.inf)},
+        ]
+        for data_field in invalid_data_fields:
+            output["data"] = data_field
+            self.output_validator.validate([output])
+            with pytest.raises(InvalidFormatException):
+                deep_validator.validate([output])
+
+        output = dict(self.sample_output, probability=np.array([0.5, np.nan]))
+        self.output_validator.validate([output])
+        with pytest.raises(InvalidFormatException):
+            deep_validator.validate([output])
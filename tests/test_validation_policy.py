@@ -0,0 +1,69 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from mdai.validation_policy import ValidationPolicy
+import pytest
+
+
+def validate(results_list):
+    for results in results_list:
+        if results == ["invalid"]:
+            raise ValueError("invalid output")
+
+
+class TestValidationPolicy:
+    def check_all(self, policy, results_lists):
+        async def main():
+            outcomes = []
+            for results_list in results_lists:
+                try:
+                    await policy.check(results_list)
+                    outcomes.append(True)
+                except ValueError:
+                    outcomes.append(False)
+            return outcomes
+
+        return asyncio.run(main())
+
+    def test_strict(self):
+        policy = ValidationPolicy(validate)
+        assert self.check_all(policy, [[["valid"]], [["invalid"]]] * 2) == [True, False] * 2
+        assert policy.stats()["validated"] == 4
+        assert policy.stats()["failed"] == 2
+
+    def test_sampled(self):
+        policy = ValidationPolicy(validate, "sampled", interval=3)
+        outcomes = self.check_all(policy, [[["invalid"]]] * 7)
+        assert outcomes == [False, True, True, False, True, True, False]
+        assert policy.stats()["skipped"] == 4
+
+    def test_shadow(self):
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            policy = ValidationPolicy(validate, "shadow", shadow_executor=executor)
+            outcomes = self.check_all(policy, [[["invalid"]], [["valid"]]])
+        assert outcomes == [True, True]
+        stats = policy.stats()
+        assert (stats["validated"], stats["failed"], stats["pending"]) == (2, 1, 0)
+
+    def test_shadow_skips_when_backlogged(self):
+        policy = ValidationPolicy(validate, "shadow", max_pending=1)
+        policy.pending = 1
+        assert not policy.sample()
+        assert policy.stats()["skipped"] == 1
+
+    def test_shadow_skips_chunks_when_backlogged(self):
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            policy = ValidationPolicy(validate, "shadow", max_pending=1, shadow_executor=executor)
+            assert policy.sample()
+            # Chunks of a streamed response are validated one by one once it has been sampled
+            policy.pending = 1
+            asyncio.run(policy.validate([["valid"]]))
+            policy.pending = 0
+            asyncio.run(policy.validate([["invalid"]]))
+        stats = policy.stats()
+        assert (stats["validated"], stats["failed"], stats["skipped"]) == (1, 1, 1)
+
+    def test_invalid_settings(self):
+        with pytest.raises(ValueError):
+            ValidationPolicy(validate, "lenient")
+        with pytest.raises(ValueError):
+            ValidationPolicy(validate, "sampled", interval=0)
@@ -0,0 +1,50 @@
+import copy
+from io import BytesIO
+from mdai.volume import assemble_volume
+import numpy as np
+import pydicom
+from pydicom.data import get_testdata_file
+import pytest
+
+
+class TestAssembleVolume:
+    def setup_method(self):
+        self.template = pydicom.dcmread(get_testdata_file("CT_small.dcm"))
+        self.template.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+        self.template.PixelSpacing = [0.5, 0.7]
+
+    def make_file(self, z, value, intercept=-1024, **tags):
+        ds = copy.deepcopy(self.template)
+        ds.ImagePositionPatient = [-10, -20, z]
+        ds.RescaleSlope = 2
+        ds.RescaleIntercept = intercept
+        pixels = np.full((ds.Rows, ds.Columns), value, dtype=np.int16)
+        ds.PixelData = pixels.tobytes()
+        for key, tag_value in tags.items():
+            setattr(ds, key, tag_value)
+        buffer = BytesIO()
+        ds.save_as(buffer)
+        return {"content": buffer.getvalue(), "content_type": "application/dicom"}
+
+    def test_sorted_and_rescaled(self):
+        files = [self.make_file(z, value=z) for z in [5, 1, 3]]
+        files.append({"content": "notes", "content_type": "text/plain"})
+        volume = assemble_volume(files)
+
+        assert volume.array.shape == (3, 128, 128)
+        assert volume.array.dtype == np.float32 and volume.array.flags.c_contiguous
+        assert volume.array[:, 0, 0].tolist() == [2 * z - 1024 for z in [1, 3, 5]]
+        assert [ds.ImagePositionPatient[2] for ds in volume.datasets] == [1, 3, 5]
+        assert volume.spacing == (2.0, 0.5, 0.7)
+
+        # Index (slice, row, column) to patient coordinates
+        corner = volume.affine @ np.array([2, 10, 4, 1])
+        np.testing.assert_allclose(corner[:3], [-10 + 4 * 0.7, -20 + 10 * 0.5, 5])
+
+    def test_mismatched_orientation(self):
+        files = [
+            self.make_file(1, value=0),
+            self.make_file(2, value=0, ImageOrientationPatient=[0, 1, 0, 0, 0, -1]),
+        ]
+        with pytest.raises(ValueError):
+            assemble_volume(files)
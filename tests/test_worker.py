@@ -0,0 +1,111 @@
+import mmap
+import os
+import sys
+from mdai.worker import WorkerError, WorkerModel
+import numpy as np
+import pytest
+
+WORKER_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "mdai", "worker.py")
+
+MODEL_SOURCE = """
+import os
+import numpy as np
+
+
+class MDAIModel:
+    def __init__(self):
+        self.warmed_up = False
+
+    def warmup(self):
+        self.warmed_up = True
+
+    def predict(self, data):
+        print("printed output does not break the protocol")
+        if data["args"].get("fail"):
+            raise ValueError("bad input")
+        if data["args"].get("exit"):
+            os._exit(3)
+        if "outputs" in data["args"]:
+            return data["args"]["outputs"]
+        if data["args"].get("generate"):
+            return iter([{"type": "NONE"}])
+        return [
+            {
+                "type": "ANNOTATION",
+                "sizes": [len(file["content"]) for file in data["files"]],
+                "pid": os.getpid(),
+                "warmed_up": self.warmed_up,
+                "data": {"mask": np.eye(2, dtype=np.uint8)},
+            }
+        ]
+
+
+class BrokenModel:
+    def __init__(self):
+        raise RuntimeError("weights not found")
+"""
+
+
+@pytest.fixture
+def model_dir(tmp_path):
+    (tmp_path / "infer.py").write_text(MODEL_SOURCE)
+    return str(tmp_path)
+
+
+def make_worker(model_dir, model="infer:MDAIModel"):
+    return WorkerModel([sys.executable, WORKER_PATH, model], cwd=model_dir)
+
+
+class TestWorkerModel:
+    def test_predict(self, model_dir):
+        worker = make_worker(model_dir)
+        try:
+            with mmap.mmap(-1, 5) as content:
+                data = {
+                    "files": [{"content": b"abc"}, {"content": content}],
+                    "args": {},
+                    "datasets": [object()],
+                }
+                outputs = worker.predict(data)
+                assert outputs[0]["sizes"] == [3, 5]
+                assert outputs[0]["warmed_up"]
+                np.testing.assert_array_equal(outputs[0]["data"]["mask"], np.eye(2))
+
+                # The same process serves every request
+                assert worker.predict(data)[0]["pid"] == outputs[0]["pid"]
+        finally:
+            worker.close()
+
+    def test_model_error(self, model_dir):
+        worker = make_worker(model_dir)
+        try:
+            with pytest.raises(WorkerError, match="bad input"):
+                worker.predict({"files": [], "args": {"fail": True}})
+            assert worker.predict({"files": [], "args": {}})[0]["sizes"] == []
+        finally:
+            worker.close()
+
+    def test_outputs_sent_as_returned(self, model_dir):
+        worker = make_worker(model_dir)
+        try:
+            assert worker.predict({"files": [], "args": {"generate": True}}) == [{"type": "NONE"}]
+            assert worker.predict({"files": [], "args": {"outputs": None}}) is None
+            assert worker.predict({"files": [], "args": {"outputs": {"type": "NONE"}}}) == {
+                "type": "NONE"
+            }
+        finally:
+            worker.close()
+
+    def test_restart_after_exit(self, model_dir):
+        worker = make_worker(model_dir)
+        try:
+            pid = worker.predict({"files": [], "args": {}})[0]["pid"]
+            with pytest.raises(WorkerError, match="status 3"):
+                worker.predict({"files": [], "args": {"exit": True}})
+            assert worker.predict({"files": [], "args": {}})[0]["pid"] != pid
+        finally:
+            worker.close()
+
+    def test_load_error(self, model_dir):
+        with pytest.raises(WorkerError, match="weights not found"):
+            make_worker(model_dir, "infer:BrokenModel")